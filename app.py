@@ -3,15 +3,19 @@ __author__ = 'Jon'
 '''
 项目启动文件
 '''
+import signal
 import traceback
 import tornado.ioloop
 import tornado.web
 
+from tornado.gen import coroutine
 from tornado.options import options, define, parse_command_line
 from route import routes
+from service.server.server import ServerService
 from setting import settings
 from utils.log import LOG
 from utils.db import DB, REDIS
+from utils.deployed import DEPLOYED_CACHE
 from constant import TORNADO_MAX_BODY_SIZE
 
 
@@ -34,10 +38,28 @@ class Application(tornado.web.Application):
         self.settings = settings
 
 
+@coroutine
+def shutdown(server):
+    ''' 停止接收请求, 把上报写缓冲中剩余的数据写入数据库后退出
+    '''
+    server.stop()
+    yield ServerService.report_buffer.flush()
+    # 写入失败的数据重试到成功或超过重试次数为止
+    while ServerService.report_buffer.failed:
+        yield ServerService.report_buffer.flush()
+    LOG.info('Server Stop...')
+    tornado.ioloop.IOLoop.instance().stop()
+
+
 def main():
     try:
         app = Application()
-        app.listen(address=options.address, port=options.port, max_body_size=TORNADO_MAX_BODY_SIZE)
+        DEPLOYED_CACHE.start()
+        server = app.listen(address=options.address, port=options.port, max_body_size=TORNADO_MAX_BODY_SIZE)
+
+        for sig in [signal.SIGTERM, signal.SIGINT]:
+            signal.signal(sig, lambda *_: tornado.ioloop.IOLoop.instance().add_callback_from_signal(shutdown, server))
+
         LOG.info('Sever Listen {port}...'.format(port=options.port))
         tornado.ioloop.IOLoop.instance().start()
     except:
@@ -18,6 +18,8 @@ IMAGEHUB_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 DEPLOYING = 'deploying'
 DEPLOYED  = 'deployed'
 DEPLOYED_FLAG = '1'
+DEPLOYED_CHANNEL = 'deployed_channel'  # 部署状态变化的pub/sub频道, 消息: 'add:{ip}' / 'del:{ip}'
+DEPLOYED_RETRY = 3  # 订阅断开后重连的间隔(秒)
 AUTH_CODE = 'auth_code_{mobile}'
 AUTH_CODE_ERROR_COUNT = 'auth_code_error_count_{mobile}'
 AUTH_LOCK = 'auth_lock_{mobile}'
@@ -42,7 +44,14 @@ ADMIN_CHANGED = 'admin_changed'
 ADMIN_NOT_CHANGED = 0
 EMPLOYEE_TO_ADMIN = 1
 ADMIN_TO_EMPLOYEE = 2
-SERVERS_REPORT_INFO = 'servers_report_info'
+SERVERS_REPORT_INFO = 'servers_report_info'  # hash, 主机最新上报数据的摘要(REPORT_SUMMARY_FIELDS)
+REPORT_SUMMARY_FIELDS = ['cpu', 'memory', 'disk', 'net', 'system_load', 'time']  # 列表等处需要的上报字段
+SERVER_REPORT_DETAIL = 'server_report_detail_{public_ip}'  # hash, 主机最新上报的REPORT_DETAIL_FIELDS, 按需读取
+REPORT_DETAIL_FIELDS = ['docker']  # 单独保存的上报字段, k8s_*已写入各k8s对象表, 不再保存
+SERVER_REPORT_DETAIL_TIMEOUT = 86400  # SERVER_REPORT_DETAIL的过期时间, 主机停止上报后自动删除
+SERVER_LATEST = 'server_latest_{form}_{lord}'  # hash, 租户的主机最新状态, 见utils/latest.py
+SERVER_LATEST_INDEX = 'server_latest_index'  # hash, public_ip -> '{SERVER_LATEST}:{主机id}'
+SERVER_NAME_VERSION = 'server_name_version_{form}_{lord}'  # 租户主机名的版本号, 变化时各进程重建主机名索引, 见utils/name_index.py
 INSTANCE_STATUS = 'instance_status'
 #################################################################################################
 # 错误代码及信息
@@ -820,3 +829,92 @@ MONITOR_COLOR_TYPE = {
     'safe': 4,
     'free': 5
 }
+
+#################################################################################################
+# 主机上报相关
+#################################################################################################
+REPORT_BUFFER_SIZE = 500       # 上报写缓冲的行数上限, 达到即写入数据库
+REPORT_BUFFER_INTERVAL = 1000  # 上报写缓冲的最长停留时间(毫秒)
+REPORT_BUFFER_RETRIES = 3      # 上报写缓冲写入失败的数据随后续写入重试的次数, 超过后丢弃
+REPORT_BULK_BATCH = 100        # 批量上报时每批处理的条数
+REPORT_FRESHNESS = 86400       # 监控墙/告警列表中最新上报数据的有效期(秒), 超过时视为没有数据
+REPORT_BULK_MAX_SIZE = 256 * 1024 * 1024  # 批量上报解压后的最大字节数, 超过时返回413
+REPORT_QUEUE = 'report_queue'              # list, 上报队列, 见settings['report_queue']
+REPORT_QUEUE_STATS = 'report_queue_stats'  # hash, 上报队列的指标: 长度/延迟/处理数/失败数
+REPORT_QUEUE_BATCH = 200       # worker每次从上报队列取出的条数
+REPORT_QUEUE_IDLE = 1          # 上报队列为空时worker等待的秒数
+REPORT_QUEUE_MAX_LENGTH = 100000  # 上报队列的最大长度, 超过时上报返回503
+K8S_RESOURCE_DIGEST = 'k8s_resource_digest_{public_ip}'  # hash, 主机最近一次上报的各个k8s对象写入数据库时的digest
+K8S_RESOURCE_DIGEST_TIMEOUT = 86400          # 主机不再上报k8s信息时K8S_RESOURCE_DIGEST的过期时间
+K8S_NAME_CACHE_TIMEOUT = 60    # deployment/service名称->id的进程内缓存时间(秒)
+K8S_NAME_CACHE_SIZE = 4096     # deployment/service名称->id的进程内LRU缓存个数
+K8S_PARSE_CACHE_SIZE = 256     # 已解析的k8s资源列表的进程内LRU缓存个数
+K8S_DUMP_CACHE_SIZE = 4096     # k8s对象YAML序列化结果的进程内LRU缓存个数
+K8S_REPORT_DIGEST = 'k8s_report_digest_{public_ip}'  # hash, 各主机最后写入k8s/k8s_node表的内容digest及刷新时间
+K8S_REPORT_DIGEST_TIMEOUT = 86400  # 主机不再上报时K8S_REPORT_DIGEST的过期时间
+K8S_REPORT_REFRESH_INTERVAL = 600  # k8s信息没有变化时, 刷新k8s/k8s_node表update_time的间隔(秒)
+
+#################################################################################################
+# 性能数据(server_metric/container_metric表)相关
+#################################################################################################
+# server_metric表的字段: (字段名, 上报数据中的key, 上报数据中的子key)
+SERVER_METRIC_COLUMNS = (
+    ('cpu_percent', 'cpu', 'percent'),
+    ('mem_total', 'memory', 'total'),
+    ('mem_free', 'memory', 'free'),
+    ('mem_available', 'memory', 'available'),
+    ('mem_percent', 'memory', 'percent'),
+    ('disk_total', 'disk', 'total'),
+    ('disk_free', 'disk', 'free'),
+    ('disk_percent', 'disk', 'percent'),
+    ('disk_utilize', 'disk', 'utilize'),
+    ('net_input', 'net', 'input'),
+    ('net_output', 'net', 'output'),
+)
+
+# container_metric表的字段: (字段名, 上报数据docker.{name}中的key)
+CONTAINER_METRIC_COLUMNS = (
+    ('cpu_percent', 'cpu'),
+    ('mem_percent', 'mem_percent'),
+    ('mem_limit', 'mem_limit'),
+    ('mem_usage', 'mem_usage'),
+    ('net_input', 'net_input'),
+    ('net_output', 'net_output'),
+    ('block_input', 'block_input'),
+    ('block_output', 'block_output'),
+)
+
+SERVER_METRIC_RECENT = 'server_metric_recent_{public_ip}'  # zset, 主机最近的性能数据, score为上报时间
+METRIC_RECENT_WINDOW = 7200  # SERVER_METRIC_RECENT保留的时间跨度(秒), 查询范围在此之内的直接从redis返回
+METRIC_RECENT_TOLERANCE = 60  # SERVER_METRIC_RECENT最早的数据晚于查询起始时间超过此秒数时, 认为数据不完整, 查询数据库
+DEFAULT_SAMPLE_POINTS = 60  # 主机所有容器的性能数据默认降采样的点数
+MAX_SAMPLE_POINTS = 1000  # 性能数据降采样(points参数)的最大点数
+SAMPLE_TYPES = ['avg', 'max', 'lttb']  # 降采样方式: 桶内平均值/桶内最大值/Largest-Triangle-Three-Buckets
+# lttb取点的依据(字段之和), 容器数据各项共用一组点
+METRIC_LTTB_FIELDS = {
+    'cpu': ['cpu_percent'],
+    'memory': ['mem_percent'],
+    'disk': ['disk_percent'],
+    'net': ['net_input', 'net_output'],
+    'container': ['cpu_percent'],
+}
+# 性能数据的分辨率层级(由细到粗): (表名, 每行数据的秒数), 见ServerService._get_auto_performance
+METRIC_TIERS = (
+    ('server_metric', 0),
+    ('server_log_minute', 60),
+    ('server_log_hour', 3600),
+    ('server_log_day', 86400),
+)
+METRIC_ROLLUP = 'metric_rollup_{resolution}_{bucket}'  # hash, 上报时累计的主机性能数据, field为'{ip}:count'/'{ip}:{字段}:{sum/sumsq/min/max}'
+METRIC_ROLLUP_RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}  # 累计的时间粒度(秒), 按本地时间对齐; 汇总任务只用minute, hour/day只供查询当前时间段的统计值
+METRIC_ROLLUP_TIMEOUT = 3600  # 时间段结束后METRIC_ROLLUP保留的秒数, crontab/sync_server_log.py需要在此之前保存
+METRIC_MIGRATE_BATCH = 5000  # 旧表数据迁移到server_metric/container_metric时每批的行数
+ROLLUP_INSERT_BATCH = 500  # crontab/sync_server_log.py中每条INSERT语句的最大行数
+METRIC_BACKFILL = 'metric_backfill_{mode}'  # hash, crontab/sync_server_log.py补算的进度: task/last/done/total
+METRIC_BACKFILL_TIMEOUT = 7 * 86400  # METRIC_BACKFILL的过期时间
+BACKFILL_COMMIT_BUCKETS = 10  # 补算时每提交一次处理的时间段数
+ROLLUP_PERCENTILES = [50, 95, 99]  # 汇总表中除平均值/最大值外保存的百分位数, 保存为'{key}_p50'等
+ROLLUP_STATS_HOSTS = 50  # crontab/sync_server_log.py每批读取原始数据的主机数
+ROLLUP_MINUTE_LAG = 120  # 分钟汇总只处理此秒数之前结束的时间段, 等待缓冲/排队中的上报写入, 见settings['rollup_minute_lag']
+METRIC_MINUTE_RETENTION = 7 * 86400  # server_log_minute默认的保留时间(秒), 见settings['metric_minute_retention']
+METRIC_PRUNE_BATCH = 10000  # crontab/metric_partition.py删除过期数据时每条DELETE语句的最大行数
@@ -18,6 +18,8 @@ from utils.qcloud import Qcloud
 from utils.zcloud import Zcloud
 from utils.datetool import seconds_to_human
 from utils.general import get_formats, get_in_formats
+from utils.latest import LATEST_STORE, LATEST_SQL
+from utils.name_index import bump_version
 from constant import ALIYUN_NAME, QCLOUD_NAME, ALIYUN_REGION_NAME, QCLOUD_REGION_NAME, ZCLOUD_REGION_LIST, \
     ZCLOUD_TYPE, ZCLOUD_NAME, ZCLOUD_REGION_NAME, TCLOUD_STATUS_MAKER, TCLOUD_STATUS, TENCLOUD_DISK_TYPE, \
     TENCLOUD_INTERNET_PAID,TENCLOUD_INSTANCE_PAID, ALIYUN_INSTANCE_PAID, ALIYUN_INTERNET_PAID, INSTANCE_STATUS
@@ -230,11 +232,18 @@ class Instance:
         if update_instances: self._to_update(update_instances)
 
     def _to_del(self, instances):
+        sql = 'SELECT lord, form FROM server WHERE ' + get_in_formats('instance_id', instances)
+        self.cur.execute(sql, instances)
+        servers = self.cur.fetchall()
+
         for table in ['server', 'instance']:
             sql = 'DELETE FROM ' + table + ' WHERE ' + get_in_formats('instance_id', instances)
 
             self.cur.execute(sql, instances)
 
+        if servers:
+            bump_version(self.redis, servers)
+
     def _to_add(self, instances):
         for instance in instances:
             keys = self.data[instance].keys()
@@ -281,6 +290,12 @@ class Instance:
     def _change_format(self, result):
         return {i['instance_id']: i for i in result}
 
+    def rebuild_latest(self):
+        ''' 实例同步后全量重建LATEST_STORE中的主机与实例信息(状态/名称/带宽等), 删除已不存在的主机
+        '''
+        self.cur.execute(LATEST_SQL.format(where=''))
+        LATEST_STORE.save(self.cur.fetchall(), rebuild=True)
+
 
 def main():
     parser = argparse.ArgumentParser(description='Different clouds')
@@ -301,6 +316,7 @@ def main():
         try:
             cloud_func[args.cloud]()
             obj.save()
+            obj.rebuild_latest()
         except Exception:
             logging.error(traceback.format_exc())
         finally:
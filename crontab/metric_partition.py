@@ -0,0 +1,144 @@
+__author__ = 'Jon'
+
+'''维护server_metric/container_metric表按created_time的RANGE分区, 并删除server_log_minute的过期数据
+
+    Usage::
+        python crontab/metric_partition.py          # 定时执行(e.g. 每小时), 提前创建分区并删除过期分区
+        python crontab/metric_partition.py --init   # 把未分区的表转为分区表(只需执行一次, 会锁表重建)
+
+    * 每个分区的时间跨度为settings['metric_partition_interval'], 分区名为p{上界时间戳}
+    * 最后一个分区p_max(MAXVALUE)兜底, 新分区从p_max中拆分(REORGANIZE), p_max为空时只修改元数据
+    * 上界不晚于 now - settings['metric_retention'] 的分区直接DROP, 不逐行DELETE
+    * server_log_minute中start_time早于 now - settings['metric_minute_retention'] 的数据每次最多删除METRIC_PRUNE_BATCH行, 直到删完
+'''
+import sys
+import time
+import argparse
+import logging
+
+logging.basicConfig(stream=sys.stdout, level=logging.WARN)
+
+import pymysql.cursors
+from setting import settings
+from constant import METRIC_PRUNE_BATCH, METRIC_MINUTE_RETENTION
+
+
+db = pymysql.connect(host=settings['mysql_host'],
+                     user=settings['mysql_user'],
+                     password=settings['mysql_password'],
+                     db=settings['mysql_database'],
+                     charset=settings['mysql_charset'],
+                     cursorclass=pymysql.cursors.DictCursor,
+                     autocommit=True)
+
+
+class MetricPartition:
+    tables = ['server_metric', 'container_metric']
+
+    def __init__(self, interval, ahead, retention):
+        self.interval = interval
+        self.ahead = ahead
+        self.retention = retention
+        self.now = int(time.time())
+
+    def bound(self, t):
+        ''' t所在分区的上界 '''
+        return (t // self.interval + 1) * self.interval
+
+    def get_partitions(self, table):
+        '''
+        :return: [(分区名, 上界)], p_max的上界为None; 未分区的表返回[]
+        '''
+        with db.cursor() as cur:
+            sql = """
+                SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS bound
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s
+                ORDER BY PARTITION_ORDINAL_POSITION
+                """
+            cur.execute(sql, [settings['mysql_database'], table])
+            data = cur.fetchall()
+
+        return [(i['name'], None if i['bound'] == 'MAXVALUE' else int(i['bound'])) for i in data if i['name']]
+
+    def execute(self, sql):
+        logging.warning(sql)
+        with db.cursor() as cur:
+            cur.execute(sql)
+
+    def init(self, table):
+        if self.get_partitions(table):
+            logging.warning('{} is already partitioned'.format(table))
+            return
+
+        bound = self.bound(self.now)
+        self.execute('ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_time)'.format(table=table))
+        self.execute("""ALTER TABLE {table} PARTITION BY RANGE (created_time) (
+                            PARTITION p{bound} VALUES LESS THAN ({bound}),
+                            PARTITION p_max VALUES LESS THAN MAXVALUE
+                        )""".format(table=table, bound=bound))
+
+    def create(self, table, partitions):
+        ''' 从p_max中拆分出到 now + ahead个interval 为止的分区 '''
+        bounds = [b for _, b in partitions if b]
+        last = max(bounds) if bounds else self.bound(self.now) - self.interval
+        end = self.bound(self.now) + self.ahead * self.interval
+
+        new = ['PARTITION p{0} VALUES LESS THAN ({0})'.format(b) for b in range(last + self.interval, end + 1, self.interval)]
+        if not new:
+            return
+
+        self.execute('ALTER TABLE {table} REORGANIZE PARTITION p_max INTO ({new}, PARTITION p_max VALUES LESS THAN MAXVALUE)'
+                     .format(table=table, new=', '.join(new)))
+
+    def drop(self, table, partitions):
+        expired = [name for name, b in partitions if b and b <= self.now - self.retention]
+        if not expired:
+            return
+
+        self.execute('ALTER TABLE {table} DROP PARTITION {names}'.format(table=table, names=', '.join(expired)))
+
+    def run(self, init=False):
+        for table in self.tables:
+            if init:
+                self.init(table)
+
+            partitions = self.get_partitions(table)
+            if not partitions:
+                logging.warning('{} is not partitioned, run with --init first'.format(table))
+                continue
+
+            self.create(table, partitions)
+            self.drop(table, partitions)
+
+        self.prune('server_log_minute', settings.get('metric_minute_retention', METRIC_MINUTE_RETENTION))
+
+    def prune(self, table, retention):
+        ''' 分批删除start_time早于 now - retention 的数据, 避免一次删除大量数据长时间锁表 '''
+        sql = 'DELETE FROM {table} WHERE start_time < %s LIMIT {batch}'.format(table=table, batch=METRIC_PRUNE_BATCH)
+        total = 0
+
+        with db.cursor() as cur:
+            while True:
+                num = cur.execute(sql, [self.now - retention])
+                total += num
+                if num < METRIC_PRUNE_BATCH:
+                    break
+
+        logging.warning('{}: {} rows deleted'.format(table, total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain metric table partitions')
+    parser.add_argument('--init', action='store_true', help='partition the tables that are not partitioned yet')
+    args = parser.parse_args()
+
+    MetricPartition(interval=settings['metric_partition_interval'],
+                    ahead=settings['metric_partition_ahead'],
+                    retention=settings['metric_retention']).run(init=args.init)
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
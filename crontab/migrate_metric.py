@@ -0,0 +1,135 @@
+__author__ = 'Jon'
+
+'''把cpu/memory/disk/net/docker_stat表中JSON格式的性能数据迁移到server_metric/container_metric表
+
+    Usage::
+        python crontab/migrate_metric.py --type=server --batch=5000
+        python crontab/migrate_metric.py --type=container --start-id=123456
+
+    * 按旧表的id顺序分批迁移, 每批与迁移进度(metric_migrate表中最后的id)在同一个事务中提交
+    * 重新执行时从记录的进度之后继续, 已迁移的id不会重复写入; --start-id只能向后跳过, 不能早于记录的进度
+    * 同一时间点的cpu/memory/disk/net数据合并为server_metric的一行, 以cpu表为准
+'''
+import sys
+import json
+import argparse
+import logging
+
+logging.basicConfig(stream=sys.stdout, level=logging.WARN)
+
+import pymysql.cursors
+from setting import settings
+from utils.general import get_formats
+from utils.metric import server_metric_fields, server_metric_values, container_metric_fields, container_metric_values
+from constant import METRIC_MIGRATE_BATCH
+
+
+db = pymysql.connect(host=settings['mysql_host'],
+                     user=settings['mysql_user'],
+                     password=settings['mysql_password'],
+                     db=settings['mysql_database'],
+                     charset=settings['mysql_charset'],
+                     cursorclass=pymysql.cursors.DictCursor)
+
+
+def _loads(content):
+    return json.loads(content) if content else {}
+
+
+def fetch_server(cur, start_id, batch):
+    sql = """
+        SELECT c.id, c.public_ip, c.created_time, c.content AS cpu, m.content AS memory, d.content AS disk, n.content AS net
+        FROM cpu AS c
+        LEFT JOIN memory AS m ON c.public_ip=m.public_ip AND c.created_time=m.created_time
+        LEFT JOIN disk AS d ON c.public_ip=d.public_ip AND c.created_time=d.created_time
+        LEFT JOIN net AS n ON c.public_ip=n.public_ip AND c.created_time=n.created_time
+        WHERE c.id>%s
+        ORDER BY c.id
+        LIMIT %s
+    """
+    cur.execute(sql, [start_id, batch])
+
+    rows, ids = [], []
+    for i in cur.fetchall():
+        report = {table: _loads(i[table]) for table in ['cpu', 'memory', 'disk', 'net']}
+        rows.append([i['public_ip'], i['created_time']] + server_metric_values(report))
+        ids.append(i['id'])
+
+    return rows, ids
+
+
+def fetch_container(cur, start_id, batch):
+    sql = """
+        SELECT id, public_ip, created_time, container_name, content
+        FROM docker_stat
+        WHERE id>%s
+        ORDER BY id
+        LIMIT %s
+    """
+    cur.execute(sql, [start_id, batch])
+
+    rows, ids = [], []
+    for i in cur.fetchall():
+        rows.append([i['public_ip'], i['created_time'], i['container_name']] + container_metric_values(_loads(i['content'])))
+        ids.append(i['id'])
+
+    return rows, ids
+
+
+def get_checkpoint(table):
+    ''' 已迁移到table的旧表最大id, 没有迁移过时为0 '''
+    with db.cursor() as cur:
+        cur.execute('SELECT last_id FROM metric_migrate WHERE table_name=%s', [table])
+        row = cur.fetchone()
+    return row['last_id'] if row else 0
+
+
+def migrate(fetch, table, fields, start_id, batch):
+    checkpoint = get_checkpoint(table)
+    if checkpoint > start_id:
+        logging.warning('{:>16}: continue after migrated id {}'.format(table, checkpoint))
+        start_id = checkpoint
+
+    total = 0
+
+    while True:
+        with db.cursor() as cur:
+            rows, ids = fetch(cur, start_id, batch)
+            if not rows:
+                break
+
+            sql = 'INSERT INTO {table}({fields}) VALUES ({formats})'.format(table=table, fields=fields,
+                                                                             formats=get_formats(rows[0]))
+            cur.executemany(sql, rows)
+            cur.execute('INSERT INTO metric_migrate (table_name, last_id) VALUES (%s, %s)'
+                        ' ON DUPLICATE KEY UPDATE last_id=VALUES(last_id)', [table, ids[-1]])
+
+        db.commit()
+        start_id = ids[-1]
+        total += len(rows)
+        logging.warning('{:>16}: {} rows, last id {}'.format(table, total, start_id))
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate JSON metric tables to typed metric tables')
+    parser.add_argument('--type', choices=['server', 'container', 'all'], default='all')
+    parser.add_argument('--batch', type=int, default=METRIC_MIGRATE_BATCH, help='rows per batch')
+    parser.add_argument('--start-id', type=int, default=0, help='skip ids of the old table up to this one, '
+                                                                    'ids already migrated are always skipped')
+    args = parser.parse_args()
+
+    if args.type in ['server', 'all']:
+        migrate(fetch_server, 'server_metric', 'public_ip, created_time, ' + server_metric_fields(),
+                args.start_id, args.batch)
+
+    if args.type in ['container', 'all']:
+        migrate(fetch_container, 'container_metric', 'public_ip, created_time, container_name, ' + container_metric_fields(),
+                args.start_id, args.batch)
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
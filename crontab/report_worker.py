@@ -0,0 +1,83 @@
+__author__ = 'Jon'
+
+'''从上报队列中批量取出主机上报的数据并保存, 配合settings['report_queue'] = True使用
+
+    Usage::
+        python crontab/report_worker.py --batch=200
+
+    * 每批处理完后, 把队列长度/延迟/处理数/失败数记录到redis的REPORT_QUEUE_STATS
+    * 数据取出即从队列删除, worker异常退出时正在处理的一批会丢失
+    * 收到SIGTERM/SIGINT时处理完当前一批, 写完上报写缓冲后退出
+'''
+import sys
+import time
+import signal
+import argparse
+import traceback
+import logging
+
+logging.basicConfig(stream=sys.stdout, level=logging.WARN)
+
+from tornado.gen import coroutine, sleep
+from tornado.ioloop import IOLoop
+
+from service.server.report import ServerReportService
+from utils.deployed import DEPLOYED_CACHE
+from constant import REPORT_QUEUE_BATCH, REPORT_QUEUE_IDLE
+
+
+class ReportWorker:
+    def __init__(self, batch=REPORT_QUEUE_BATCH):
+        self.batch = batch
+        self.running = True
+        self.service = ServerReportService()
+
+    def stop(self, *args):
+        self.running = False
+
+    @coroutine
+    def run(self):
+        while self.running:
+            reports, depth = self.service.dequeue(self.batch)
+
+            if not reports:
+                self.service.record_queue_stats(depth)
+                yield sleep(REPORT_QUEUE_IDLE)
+                continue
+
+            start_time = time.time()
+            lag = start_time - min(report.pop('enqueue_time', start_time) for report in reports)
+
+            try:
+                failed = yield self.service.handle_batch(reports)
+            except Exception:
+                failed = len(reports)
+                logging.error(traceback.format_exc())
+
+            self.service.record_queue_stats(depth, lag=lag, processed=len(reports), failed=failed)
+            logging.warning('{:>12}: {} reports, {} failed, depth {}, lag {:.3f}s, cost {:.3f}s'.format(
+                'Batch', len(reports), failed, depth, lag, time.time() - start_time))
+
+        # 写入失败的数据重试到成功或超过重试次数为止, 同app.py
+        buffer = self.service.server_service.report_buffer
+        yield buffer.flush()
+        while buffer.failed:
+            yield buffer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report queue worker')
+    parser.add_argument('--batch', type=int, default=REPORT_QUEUE_BATCH, help='reports per batch')
+    args = parser.parse_args()
+
+    worker = ReportWorker(batch=args.batch)
+    DEPLOYED_CACHE.start()
+
+    for sig in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(sig, worker.stop)
+
+    IOLoop.current().run_sync(worker.run)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,30 @@
+'''按分钟/小时/天汇总主机及容器的性能数据
+
+    Usage::
+        python crontab/sync_server_log.py minute|hour|day                     # 汇总刚结束的时间段
+        python crontab/sync_server_log.py hour --from="2018-01-01 08:00" --to="2018-01-02"  # 补算缺失的时间段
+
+    * 汇总表的json中保存数值(没有数据时为null): {key}为平均值, {key}_max为最大值, {key}_p50/_p95/_p99为百分位数
+    * 分钟汇总优先使用上报时在redis中累计的值(见ServerService._save_rollup), 只有平均值和最大值, 百分位数为null;
+      redis中没有累计值的主机在SQL中按主机分组计算平均值和最大值(get_sql_stats), 不读出原始数据
+    * 分钟汇总处理至少ROLLUP_MINUTE_LAG秒(上报队列的延迟更大时按队列延迟)之前结束的一分钟, 等待缓冲/排队中的上报写入
+    * 小时/天汇总需要百分位数, 按主机分批读出时间段内的原始数据, 按主机(容器)分组后用numpy计算, 分组较多时由进程池并行计算
+    * 写入汇总表时按(主机/容器, start_time)的唯一键覆盖, 重复执行不会产生重复数据
+'''
 import json
 import time
-import statistics
-import sys
+import argparse
 import datetime
+import multiprocessing
+import numpy as np
 import pymysql.cursors
 from setting import settings
+from utils.db import REDIS
+from utils.general import get_formats, get_in_formats
+from utils.metric import rollup_key, rollup_bucket, parse_rollup
+from constant import SERVER_METRIC_COLUMNS, CONTAINER_METRIC_COLUMNS, ROLLUP_INSERT_BATCH, METRIC_ROLLUP_RESOLUTIONS, \
+                     ROLLUP_PERCENTILES, ROLLUP_STATS_HOSTS, METRIC_BACKFILL, METRIC_BACKFILL_TIMEOUT, BACKFILL_COMMIT_BUCKETS, \
+                     ROLLUP_MINUTE_LAG, REPORT_QUEUE_STATS, REPORT_QUEUE_IDLE
 
 db = pymysql.connect(host=settings['mysql_host'],
                      user=settings['mysql_user'],
@@ -13,9 +33,66 @@ db = pymysql.connect(host=settings['mysql_host'],
                      charset=settings['mysql_charset'],
                      cursorclass=pymysql.cursors.DictCursor)
 
+# 容器汇总数据的结构: container_metric字段 -> (分类, key)
+CONTAINER_LOG_KEYS = {
+    'cpu_percent': ('cpu', 'percent'),
+    'block_input': ('block', 'block_input'),
+    'block_output': ('block', 'block_output'),
+    'mem_limit': ('memory', 'memory_limit'),
+    'mem_usage': ('memory', 'memory_usage'),
+    'mem_percent': ('memory', 'memory_percent'),
+    'net_input': ('net', 'net_input'),
+    'net_output': ('net', 'net_output'),
+}
+
+# 统计项, 平均值直接保存为{key}, 其它保存为{key}_{统计项}
+STATS = ['avg', 'max'] + ['p{}'.format(p) for p in ROLLUP_PERCENTILES]
+
+
+def stat_key(key, stat):
+    return key if stat == 'avg' else '{}_{}'.format(key, stat)
+
+
+def minute_lag():
+    ''' 分钟汇总等待的秒数, 开启上报队列时不小于worker最近记录的队列延迟 '''
+    lag = settings.get('rollup_minute_lag', ROLLUP_MINUTE_LAG)
+    if settings.get('report_queue'):
+        queue_lag = REDIS.hget(REPORT_QUEUE_STATS, 'lag')
+        lag = max(lag, int(float(queue_lag or 0)) + REPORT_QUEUE_IDLE)
+    return lag
+
+
+def group_stats(item):
+    ''' 一个分组(主机或容器)在时间段内各字段的统计值, 在进程池中执行
+    :param item: (分组, 二维数组: 每行一次上报, 每列一个字段)
+    :return: (分组, {'avg': [...], 'max': [...], 'p50': [...], ...}), 列表与字段一一对应
+    '''
+    group, values = item
+    stats = {'avg': np.nanmean(values, axis=0), 'max': np.nanmax(values, axis=0)}
+    for p, v in zip(ROLLUP_PERCENTILES, np.nanpercentile(values, ROLLUP_PERCENTILES, axis=0)):
+        stats['p{}'.format(p)] = v
+
+    return group, {k: [None if np.isnan(i) else round(float(i), 2) for i in v] for k, v in stats.items()}
+
+
+def rollup_processes():
+    ''' settings['rollup_processes'], 没有设置或为0时与CPU核数相同 '''
+    return settings.get('rollup_processes') or multiprocessing.cpu_count()
+
+
+def map_stats(items, pool=None):
+    ''' 计算各分组的统计值, 有进程池且分组较多时并行计算
+    :return: {分组: 统计值}
+    '''
+    if pool is None or len(items) <= 1:
+        return dict(map(group_stats, items))
+
+    return dict(pool.map(group_stats, items, chunksize=max(len(items) // (rollup_processes() * 4), 1)))
+
 
 class ServerLog:
 
+    table_minute = 'server_log_minute'
     table_hour = 'server_log_hour'
     table_day = 'server_log_day'
     table_container_hour = 'container_log_hour'
@@ -28,6 +105,12 @@ class ServerLog:
         self.end_time = 0
         self.start_time = 0
 
+    def time_minute(self):
+        ''' 至少minute_lag()秒之前结束的一分钟 '''
+        self.end_time = rollup_bucket(time.time() - minute_lag(), 60)
+        self.start_time = self.end_time - 60
+        return
+
     def time_hour(self):
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:00:00")
         now_tuple = datetime.datetime.strptime(now, "%Y-%m-%d %H:%M:%S").timetuple()
@@ -51,206 +134,212 @@ class ServerLog:
             ips = cur.fetchall()
         return [x['public_ip'] for x in ips]
 
-    def get_data(self, ip, table, fields):
+    def get_stats(self, table, fields, group, ips=None):
+        ''' 按主机分批(每批ROLLUP_STATS_HOSTS台)读出时间段内的原始数据并计算统计值, 内存中只保留一批的数据
+        :param fields: 字段, e.g. ['cpu_percent', 'mem_percent']
+        :param group:  分组字段, 第一个为public_ip, e.g. ['public_ip'] or ['public_ip', 'container_name']
+        :param ips:    只计算这些主机, 默认为全部主机
+        :return: {(public_ip, ...): {'avg': [...], 'max': [...], 'p50': [...], ...}}
+        '''
+        ips = self.ips if ips is None else ips
+        processes = rollup_processes()
+        pool = multiprocessing.Pool(processes) if processes > 1 and len(ips) > 1 else None
+
+        data = {}
+        try:
+            for i in range(0, len(ips), ROLLUP_STATS_HOSTS):
+                chunk = ips[i:i+ROLLUP_STATS_HOSTS]
+                rows = {}
+                with self.db.cursor(pymysql.cursors.SSCursor) as cur:
+                    sql = """
+                        SELECT {group}, {fields}
+                        FROM {table}
+                        WHERE {ips} AND created_time >= %s AND created_time < %s
+                        """.format(table=table, group=', '.join(group), fields=', '.join(fields),
+                                   ips=get_in_formats('public_ip', chunk))
+                    cur.execute(sql, chunk + [self.start_time, self.end_time])
+
+                    n = len(group)
+                    for row in cur:
+                        rows.setdefault(row[:n], []).append(row[n:])
+
+                data.update(map_stats([(k, np.array(v, dtype=float)) for k, v in rows.items()], pool))
+        finally:
+            if pool:
+                pool.terminate()
+
+        return data
+
+    def get_sql_stats(self, table, fields, ips):
+        ''' 在SQL中按主机分组计算时间段内各字段的平均值和最大值, 用于不需要百分位数的分钟汇总
+        :param ips: 只计算这些主机, 每批ROLLUP_STATS_HOSTS台
+        :return: {(public_ip,): {'avg': [...], 'max': [...]}}
+        '''
+        data = {}
         with self.db.cursor() as cur:
-            arg = [
-                ip,
-                self.start_time,
-                self.end_time,
-            ]
-            sql = """
-                SELECT {fields}
-                FROM {table}
-                WHERE public_ip = %s AND created_time >= %s AND created_time < %s
-                """.format(table=table, fields=fields)
-            cur.execute(sql, arg)
-            data = cur.fetchall()
+            for i in range(0, len(ips), ROLLUP_STATS_HOSTS):
+                chunk = ips[i:i+ROLLUP_STATS_HOSTS]
+                sql = """
+                    SELECT public_ip, {avg}, {max}
+                    FROM {table}
+                    WHERE {ips} AND created_time >= %s AND created_time < %s
+                    GROUP BY public_ip
+                    """.format(table=table, ips=get_in_formats('public_ip', chunk),
+                               avg=', '.join('AVG({0}) AS {0}'.format(f) for f in fields),
+                               max=', '.join('MAX({0}) AS {0}_max'.format(f) for f in fields))
+                cur.execute(sql, chunk + [self.start_time, self.end_time])
+
+                for row in cur.fetchall():
+                    data[(row['public_ip'],)] = {'avg': [round(row[f], 2) for f in fields],
+                                                 'max': [round(row[f + '_max'], 2) for f in fields]}
         return data
 
-    def cal_container_performance(self, ip):
-        resp = self.get_data(ip=ip, table='docker_stat', fields='container_name, content')
-        if not resp:
-            return {}
-        containers, data = dict(), dict()
-        for i in resp:
-            name = i['container_name']
-            if name not in containers:
-                containers[name] = {
-                                    'cpu': [],
-                                    'block_input': [],
-                                    'block_output': [],
-                                    'memory_usage': [],
-                                    'memory_limit': [],
-                                    'memory_percent': [],
-                                    'net_input': [],
-                                    'net_output': []
-                                    }
-            content = json.loads(i['content'])
-            containers[name]['cpu'].append(float(content['cpu']))
-            containers[name]['block_input'].append(float(content['block_input']))
-            containers[name]['block_output'].append(float(content['block_output']))
-            containers[name]['memory_limit'].append(float(content['mem_limit']))
-            containers[name]['memory_usage'].append(float(content['mem_usage']))
-            containers[name]['memory_percent'].append(float(content['mem_percent']))
-            containers[name]['net_input'].append(float(content['net_input']))
-            containers[name]['net_output'].append(float(content['net_output']))
-
-        for name in containers:
-            if name not in data:
-                data[name] = {
-                    'cpu': {},
-                    'block': {},
-                    'memory': {},
-                    'net': {}
-                }
-            data[name]['cpu'] = {'percent': "%.2f" % (statistics.mean(containers[name]['cpu']))}
-            data[name]['block'] = {
-                'block_input': "%.2f" % (statistics.mean(containers[name]['block_input'])),
-                'block_output': "%.2f" % (statistics.mean(containers[name]['block_output'])),
-            }
-            data[name]['memory'] = {
-                'memory_limit': "%.2f" % (statistics.mean(containers[name]['memory_limit'])),
-                'memory_usage': "%.2f" % (statistics.mean(containers[name]['memory_usage'])),
-                'memory_percent': "%.2f" % (statistics.mean(containers[name]['memory_percent']))
-            }
-            data[name]['net'] = {
-                'net_input': "%.2f" % (statistics.mean(containers[name]['net_input'])),
-                'net_output': "%.2f" % (statistics.mean(containers[name]['net_output']))
-            }
+    def cal_container_performance(self):
+        ''' 所有主机的容器统计值
+        :return: {ip: {container_name: {'cpu': {'percent': 1.0, 'percent_max': 2.0, ...}, 'block': {}, 'memory': {}, 'net': {}}}}
+        '''
+        fields = [col for col, _ in CONTAINER_METRIC_COLUMNS]
+        resp = self.get_stats(table='container_metric', fields=fields, group=['public_ip', 'container_name'])
+
+        data = dict()
+        for (ip, name), stats in resp.items():
+            content = {'cpu': {}, 'block': {}, 'memory': {}, 'net': {}}
+            for i, col in enumerate(fields):
+                table, key = CONTAINER_LOG_KEYS[col]
+                content[table].update({stat_key(key, stat): stats[stat][i] for stat in STATS})
+
+            data.setdefault(ip, {})[name] = content
+
+        return data
+
+    def get_rollup(self):
+        ''' 上报时已累计好的平均值/最大值(见ServerService._save_rollup), 没有累计数据时返回None
+        :return: {(ip,): {'avg': [...], 'max': [...]}}
+        '''
+        resolution = [k for k, v in METRIC_ROLLUP_RESOLUTIONS.items() if v == self.end_time - self.start_time]
+        data = REDIS.hgetall(rollup_key(resolution[0], self.start_time)) if resolution else None
+
+        if not data:
+            return None
+
+        return {(ip,): {stat: [round(i[col][stat], 2) for col, _, _ in SERVER_METRIC_COLUMNS] for stat in ['avg', 'max']}
+                for ip, i in parse_rollup(data).items()}
+
+    def cal_server(self, rollup=False):
+        ''' 所有主机cpu/disk/memory/net的统计值, 没有数据的主机各项为None
+        :param rollup: 是否优先使用redis中累计的值
+        :return: {ip: {'cpu': {'percent': 1.0, 'percent_max': 2.0, ...}, 'disk': {...}, 'memory': {...}, 'net': {...}}}
+        '''
+        resp = (self.get_rollup() if rollup else None) or {}
+
+        # redis中没有累计值的主机(e.g. 累计失败/已过期), 分钟汇总只需平均值和最大值, 在SQL中计算
+        fields = [col for col, _, _ in SERVER_METRIC_COLUMNS]
+        missing = [ip for ip in self.ips if (ip,) not in resp]
+        if missing and rollup:
+            resp.update(self.get_sql_stats(table='server_metric', fields=fields, ips=missing))
+        elif missing:
+            resp.update(self.get_stats(table='server_metric', fields=fields, group=['public_ip'], ips=missing))
+
+        data = {}
+        for ip in self.ips:
+            data[ip] = {'cpu': {}, 'disk': {}, 'memory': {}, 'net': {}}
+            stats = resp.get((ip,), {})
+            for i, (col, table, key) in enumerate(SERVER_METRIC_COLUMNS):
+                data[ip][table].update({stat_key(key, stat): stats[stat][i] if stat in stats else None
+                                        for stat in STATS})
 
         return data
 
-    def cal_cpu(self, ip):
-        data, avg = [], ''
-        resp = self.get_data(ip=ip, table='cpu', fields='content')
-        if resp:
-            for x in resp:
-                content = json.loads(x['content'])
-                data.append(content['percent'])
-            avg = "%.2f" % (statistics.mean(data))
-        return {'percent': avg}
-
-    def cal_disk(self, ip):
-        total, free, percent, util = [], [], [], []
-        total_avg, free_avg, percent_avg, util_avg = '', '', '', ''
-        resp = self.get_data(ip=ip, table='disk', fields='content')
-        if resp:
-            for x in resp:
-                content = json.loads(x['content'])
-                total.append(content['total'])
-                free.append(content['free'])
-                percent.append(content['percent'])
-                util.append(content['utilize'])
-            total_avg = "%.2f" % (statistics.mean(total))
-            free_avg = "%.2f" % (statistics.mean(free))
-            percent_avg = "%.2f" % (statistics.mean(percent))
-            util_avg = ".2f" % (statistics.mean(util))
-        return {'total': total_avg, 'free': free_avg, 'percent': percent_avg, 'utilize': util_avg}
-
-    def cal_memory(self, ip):
-        total, free, percent, avaible = [], [], [], []
-        total_avg, free_avg, percent_avg, avaible_avg = '', '', '', ''
-        resp = self.get_data(ip=ip, table='memory', fields='content')
-        if resp:
-            for x in resp:
-                content = json.loads(x['content'])
-                total.append(content['total'])
-                free.append(content['free'])
-                percent.append(content['percent'])
-                avaible.append(content['available'])
-            total_avg = "%.2f" % (statistics.mean(total))
-            free_avg = "%.2f" % (statistics.mean(free))
-            percent_avg = "%.2f" % (statistics.mean(percent))
-            avaible_avg = "%.2f" % (statistics.mean(avaible))
-        return {
-            'total': total_avg,
-            'free': free_avg,
-            'percent': percent_avg,
-            'available': avaible_avg
-        }
-
-    def cal_net(self, ip):
-        recv, send = [], []
-        recv_avg, send_avg = '', ''
-        resp = self.get_data(ip=ip, table='net', fields='content')
-        if resp:
-            for x in resp:
-                content = json.loads(x['content'])
-                recv.append(content['input'])
-                send.append(content['output'])
-            recv_avg = "%.2f" % (statistics.mean(recv))
-            send_avg = "%.2f" % (statistics.mean(send))
-        return {'input': recv_avg, 'output': send_avg}
-
-    def cal(self):
+    def cal(self, container=True, rollup=False):
+        servers = self.cal_server(rollup)
+        containers = self.cal_container_performance() if container else {}
+
         for ip in self.ips:
             one_ip = {
                 'ip': ip,
-                'cpu': json.dumps(self.cal_cpu(ip=ip)),
-                'disk': json.dumps(self.cal_disk(ip=ip)),
-                'memory': json.dumps(self.cal_memory(ip=ip)),
-                'net': json.dumps(self.cal_net(ip=ip)),
-                'containers': self.cal_container_performance(ip=ip)
+                'cpu': json.dumps(servers[ip]['cpu']),
+                'disk': json.dumps(servers[ip]['disk']),
+                'memory': json.dumps(servers[ip]['memory']),
+                'net': json.dumps(servers[ip]['net']),
+                'containers': containers.get(ip, {}),
+                'has_data': any(v is not None for i in servers[ip].values() for v in i.values())
             }
             self.data.append(one_ip)
         return
 
-    def _save(self, params, table):
+    def _insert(self, table, fields, rows, update):
+        ''' 多行INSERT, 每条语句最多ROLLUP_INSERT_BATCH行, 唯一键(主机/容器+start_time)已存在时更新update中的字段 '''
+        updates = ', '.join('{0}=VALUES({0})'.format(f) for f in update)
         with self.db.cursor() as cursor:
-            arg = [
-                params['ip'],
-                self.start_time,
-                self.end_time,
-                params['cpu'],
-                params['disk'],
-                params['memory'],
-                params['net']
-            ]
+            for i in range(0, len(rows), ROLLUP_INSERT_BATCH):
+                chunk = rows[i:i+ROLLUP_INSERT_BATCH]
+                formats = ','.join(['(' + get_formats(chunk[0]) + ')'] * len(chunk))
+                sql = 'INSERT INTO {table}({fields}) VALUES {formats} ON DUPLICATE KEY UPDATE {updates}'.format(
+                    table=table, fields=fields, formats=formats, updates=updates)
+                cursor.execute(sql, [v for row in chunk for v in row])
+
+    def _save(self, table, skip_empty=False):
+        ''' :param skip_empty: 是否跳过时间段内没有数据的主机 '''
+        rows = [[ip['ip'], self.start_time, self.end_time, ip['cpu'], ip['disk'], ip['memory'], ip['net']]
+                for ip in self.data if ip['has_data'] or not skip_empty]
+        self._insert(table, 'public_ip, start_time, end_time, cpu_log, disk_log, memory_log, net_log', rows,
+                     update=['end_time', 'cpu_log', 'disk_log', 'memory_log', 'net_log'])
+
+    def _save_container(self, table):
+        rows = [[ip['ip'], container, self.start_time, self.end_time, json.dumps(content)]
+                for ip in self.data for container, content in ip['containers'].items()]
+        self._insert(table, 'public_ip, container_name, start_time, end_time, content', rows,
+                     update=['end_time', 'content'])
+
+    def set_time(self, start_time, period):
+        self.start_time = start_time
+        self.end_time = start_time + period
+        self.data = []
+
+    def get_missing(self, table, period, start_time, end_time):
+        ''' [start_time, end_time)内汇总表中还没有数据的时间段
+        :return: [start_time, ...]
+        '''
+        with self.db.cursor() as cur:
             sql = """
-                    INSERT INTO {table} set
-                        public_ip=%s,
-                        start_time=%s,
-                        end_time=%s,
-                        cpu_log=%s,
-                        disk_log=%s,
-                        memory_log=%s,
-                        net_log=%s
+                SELECT DISTINCT start_time FROM {table}
+                WHERE start_time >= %s AND start_time < %s
                 """.format(table=table)
-            cursor.execute(sql, arg)
-
-    def _save_container(self, params, table):
-        for container in params['containers']:
-            with self.db.cursor() as cursor:
-                arg = [
-                    params['ip'],
-                    container,
-                    self.start_time,
-                    self.end_time,
-                    json.dumps(params['containers'][container])
-                ]
-                sql = """
-                        INSERT INTO {table} set
-                            public_ip=%s,
-                            container_name=%s,
-                            start_time=%s,
-                            end_time=%s,
-                            content=%s
-                    """.format(table=table)
-                cursor.execute(sql, arg)
+            cur.execute(sql, [start_time, end_time])
+            done = {i['start_time'] for i in cur.fetchall()}
+
+        return [t for t in range(start_time, end_time, period) if t not in done]
+
+    def save_minute(self):
+        # 分钟汇总数据量大, 不保存没有数据的主机
+        self._save(table=self.table_minute, skip_empty=True)
 
     def save_hour(self):
-        for ip in self.data:
-            self._save(params=ip, table=self.table_hour)
-            self._save_container(params=ip,table=self.table_container_hour)
-        self.db.commit()
-        self.db.close()
+        self._save(table=self.table_hour)
+        self._save_container(table=self.table_container_hour)
 
     def save_day(self):
-        for ip in self.data:
-            self._save(params=ip, table=self.table_day)
-            self._save_container(params=ip,table=self.table_container_day)
-        self.db.commit()
-        self.db.close()
+        self._save(table=self.table_day)
+        self._save_container(table=self.table_container_day)
+
+
+# 各汇总粒度: (每个时间段的秒数, 汇总表, 是否汇总容器)
+MODES = {
+    'minute': (60, ServerLog.table_minute, False),
+    'hour': (3600, ServerLog.table_hour, True),
+    'day': (86400, ServerLog.table_day, True),
+}
+
+
+def avg_minute():
+    server = ServerLog()
+    server.time_minute()
+    server.cal(container=False, rollup=True)
+    print("#### start sync minute ####")
+    server.save_minute()
+    server.db.commit()
+    server.db.close()
+    print("#### end sync minute ####")
 
 
 def avg_hour():
@@ -260,6 +349,8 @@ def avg_hour():
     print("#### start sync server performance log ####")
     print("#### start sync hour ####")
     server.save_hour()
+    server.db.commit()
+    server.db.close()
     print("#### end sync hour ####")
     print("#### end sync server performance log ####")
 
@@ -270,12 +361,83 @@ def avg_day():
     server.cal()
     print("#### start sync day ####")
     server.save_day()
+    server.db.commit()
+    server.db.close()
     print("#### end sync day ####")
     print("#### end sync server performance log ####")
 
 
+def backfill(mode, start_time, end_time, force=False, chunk=BACKFILL_COMMIT_BUCKETS):
+    ''' 补算[start_time, end_time)内已结束的时间段, 可重复执行
+
+        * 默认只补算汇总表中没有数据的时间段, force为True时全部重新计算(已有的数据被更新)
+        * 每chunk个时间段提交一次, 并把进度记录到METRIC_BACKFILL, 中断后以相同的参数重新执行时从记录的进度继续
+    '''
+    period, table, container = MODES[mode]
+    server = ServerLog()
+
+    # 进度按用户给出的参数记录, 不包含随当前时间变化的结束时间(--to默认为当前时间)
+    key = METRIC_BACKFILL.format(mode=mode)
+    task = '{}-{}-{}'.format(start_time, end_time, int(force))
+
+    start_time = rollup_bucket(start_time, period)
+    end_time = min(end_time, rollup_bucket(time.time(), period))
+
+    checkpoint = REDIS.hgetall(key)
+    if checkpoint.get('task') == task:
+        start_time = int(checkpoint['last']) + period
+
+    buckets = list(range(start_time, end_time, period)) if force else \
+        server.get_missing(table, period, start_time, end_time)
+    print("#### start backfill {}: {} buckets ####".format(mode, len(buckets)))
+
+    for i in range(0, len(buckets), chunk):
+        for bucket in buckets[i:i+chunk]:
+            server.set_time(bucket, period)
+            server.cal(container=container, rollup=mode == 'minute')
+            getattr(server, 'save_' + mode)()
+
+        server.db.commit()
+        REDIS.hmset(key, {'task': task, 'last': buckets[min(i+chunk, len(buckets))-1],
+                          'done': min(i+chunk, len(buckets)), 'total': len(buckets)})
+        REDIS.expire(key, METRIC_BACKFILL_TIMEOUT)
+        print("{:>12}: {}/{} buckets".format(mode, min(i+chunk, len(buckets)), len(buckets)))
+
+    server.db.close()
+    print("#### end backfill {} ####".format(mode))
+
+
+def parse_time(value):
+    ''' 时间戳 或 '%Y-%m-%d' / '%Y-%m-%d %H:%M' 格式的本地时间 '''
+    if value.isdigit():
+        return int(value)
+
+    for fmt in ['%Y-%m-%d %H:%M', '%Y-%m-%d']:
+        try:
+            return int(time.mktime(datetime.datetime.strptime(value, fmt).timetuple()))
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError('时间格式错误: {}'.format(value))
+
+
 if __name__ == '__main__':
-    if sys.argv[1] == 'hour':
+    parser = argparse.ArgumentParser(description='Roll up server/container metrics')
+    parser.add_argument('mode', choices=['minute', 'hour', 'day'])
+    parser.add_argument('--from', dest='from_time', type=parse_time,
+                        help='backfill buckets starting from this time, e.g. "2018-01-01 08:00"')
+    parser.add_argument('--to', dest='to_time', type=parse_time, help='backfill buckets ending before this time, '
+                                                                      'defaults to now')
+    parser.add_argument('--force', action='store_true', help='recompute buckets that already exist')
+    parser.add_argument('--chunk', type=int, default=BACKFILL_COMMIT_BUCKETS, help='buckets per commit')
+    args = parser.parse_args()
+
+    if args.from_time is not None:
+        # 没有--to时结束时间为无穷大(实际到当前时间为止), 中断后同样不带--to重新执行即可继续
+        backfill(args.mode, args.from_time, args.to_time or float('inf'), force=args.force, chunk=args.chunk)
+    elif args.mode == 'minute':
+        avg_minute()
+    elif args.mode == 'hour':
         avg_hour()
-    elif sys.argv[1] == 'day':
+    elif args.mode == 'day':
         avg_day()
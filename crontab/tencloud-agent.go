@@ -58,6 +58,7 @@ var (
 	cputick  = flag.Int64("cputick", 1, "cputick is cpu interval, --cputick=1")
 	dir      = flag.String("dir", "/var/log/tencloud-agent/", "dir is the directory to save dir, --dir=/var/log/tencloud-agent/")
 	debug    = flag.Bool("debug", true, "debug is to distinguish environment, --debug=true")
+	k8sFmt   = flag.String("k8s-format", "yaml", "k8s-format is kubectl output format of k8s resources except nodes, yaml or json, --k8s-format=json")
 )
 
 // floatRound 浮点数截取x位，并保持类型不变
@@ -447,7 +448,7 @@ func (a *agent) getK8sNodeInfo() (string, error) {
 }
 
 func (a *agent) getK8sResourceInfo(obj string) (string, error) {
-	out, err := exec.Command("kubectl", "get", obj, "-o", "yaml").Output()
+	out, err := exec.Command("kubectl", "get", obj, "-o", *k8sFmt).Output()
 	if err != nil {
 		return "", err
 	}
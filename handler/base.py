@@ -68,6 +68,7 @@ from service.project.project import ProjectService
 from service.project.project_versions import ProjectVersionService
 from service.repository.repository import RepositoryService
 from service.server.server import ServerService
+from service.server.report import ServerReportService
 from service.server.server_operation import ServerOperationService
 from service.user.sms import SMSService
 from service.user.user import UserService
@@ -83,6 +84,7 @@ from utils.ssh import SSH
 class BaseHandler(tornado.web.RequestHandler):
     cluster_service = ClusterService()
     server_service = ServerService()
+    server_report_service = ServerReportService()
     project_service = ProjectService()
     application_service = ApplicationService()
     image_service = ImageService()
@@ -322,6 +324,19 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return data
 
+    @coroutine
+    def get_access_uid(self):
+        ''' 与filter的判断相同, 需要数据权限过滤时(公司非管理员)返回当前用户id, 否则返回None, 用于在SQL中过滤
+        '''
+        if not self.params.get('cid'): return None
+
+        try:
+            yield self.company_employee_service.check_admin(self.params['cid'], self.current_user['id'])
+        except AppError:
+            return self.current_user['id']
+
+        return None
+
 
 class WebSocketBaseHandler(WebSocketHandler, BaseHandler):
     def check_origin(self, origin):
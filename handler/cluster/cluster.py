@@ -46,7 +46,7 @@ class ClusterDetailHandler(BaseHandler):
 
          @apiParam {Number} id 集群id
          @apiParam {Number} page
-         @apiParam {Number} page_num
+         @apiParam {Number} page_num 每页条数, 最多99条
 
          @apiSuccessExample {json} Success-Response:
              HTTP/1.1 200 OK
@@ -75,23 +75,26 @@ class ClusterDetailHandler(BaseHandler):
                          "time": int
                      }
                         ...
-                 ]
+                 ],
+                 "total": int   # 主机总数
              }
          """
         with catch(self):
             id = int(id)
 
             basic_info = yield self.cluster_service.select({'id': id}, ct=False)
-            server_list = yield self.server_service.get_brief_list(cluster_id=id, **self.get_lord())
 
-            server_list = yield self.filter(server_list)
-
-            page = int(self.params.get('page', 1))
-            page_num = int(self.params.get('page_num', MSG_PAGE_NUM))
+            access_uid = yield self.get_access_uid()
+            server_list = yield self.server_service.get_brief_page(page=self.params.get('page', 1),
+                                                                   page_num=self.params.get('page_num', MSG_PAGE_NUM),
+                                                                   access_uid=access_uid,
+                                                                   cluster_id=id,
+                                                                   **self.get_lord())
 
             self.success({
                 'basic_info': basic_info,
-                'server_list': server_list[page_num*(page-1):page_num*page]
+                'server_list': server_list['data'],
+                'total': server_list['total']
             })
 
 
@@ -230,7 +233,8 @@ class ClusterSearchHandler(BaseHandler):
         @apiParam {[]String} region_name
         @apiParam {[]String} provider_name
         @apiParam {Number} page
-        @apiParam {Number} page_num
+        @apiParam {Number} page_num 每页条数, 最多99条
+        @apiParam {Number} [with_total] 为1时data为{"server_list": [], "total": int}
 
         @apiSuccessExample {json} Success-Response:
             HTTP/1.1 200 OK
@@ -251,29 +255,22 @@ class ClusterSearchHandler(BaseHandler):
             page = int(self.params.get('page', 1))
             page_num = int(self.params.get('page_num', MSG_PAGE_NUM))
 
-            if not(server_name or provider_name or region_name):
-                data = yield self.server_service.get_brief_list(
-                    cluster_id=cluster_id,
-                    provider=provider_name,
-                    region=region_name,
-                    **self.get_lord()
-                )
-                data = yield self.filter(data)
-                self.success(data[page_num*(page-1):page_num*page])
-                return
-
-            data = yield self.server_service.get_brief_list(
-                                                            cluster_id=cluster_id,
-                                                            provider=provider_name,
-                                                            region=region_name,
-                                                            **self.get_lord()
-                                                            )
-            if server_name:
-                data = self.cluster_service.select_by_name(data=data, server_name=server_name)
-
-            data = yield self.filter(data)
-
-            self.success(data[page_num*(page-1):page_num*page])
+            access_uid = yield self.get_access_uid()
+            data = yield self.server_service.get_brief_page(
+                page=page,
+                page_num=page_num,
+                access_uid=access_uid,
+                server_name=server_name,
+                cluster_id=cluster_id,
+                provider=provider_name,
+                region=region_name,
+                **self.get_lord()
+            )
+
+            if self.params.get('with_total'):
+                self.success({'server_list': data['data'], 'total': data['total']})
+            else:
+                self.success(data['data'])
 
 
 class ClusterSummaryHandler(BaseHandler):
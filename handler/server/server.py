@@ -2,19 +2,22 @@ __author__ = 'Jon'
 
 import json
 import re
-import yaml
 
 from tornado.gen import coroutine
 from tornado.ioloop import PeriodicCallback, IOLoop
 from handler.base import BaseHandler, WebSocketBaseHandler
-from constant import DEPLOYING, DEPLOYED, DEPLOYED_FLAG, ERR_TIP
+from constant import DEPLOYING, ERR_TIP
 from utils.general import validate_ip, json_loads
+from utils.report import iter_reports
+from utils.deployed import DEPLOYED_CACHE
 from utils.security import Aes
 from utils.decorator import is_login, require
 from utils.context import catch
 from utils.faker import is_faker, fake_systemload
+from setting import settings
 from constant import MONITOR_CMD, OPERATE_STATUS, OPERATION_OBJECT_STYPE, SERVER_OPERATE_STATUS, \
-      CONTAINER_OPERATE_STATUS, RIGHT, SERVICE, FORM_COMPANY, SERVERS_REPORT_INFO, THRESHOLD, FORM_PERSON, RESOURCE_TYPE
+      CONTAINER_OPERATE_STATUS, RIGHT, SERVICE, FORM_COMPANY, SERVERS_REPORT_INFO, THRESHOLD, FORM_PERSON, RESOURCE_TYPE, \
+      REPORT_BULK_BATCH
 
 
 class ServerNewHandler(WebSocketBaseHandler):
@@ -44,7 +47,7 @@ class ServerNewHandler(WebSocketBaseHandler):
     @coroutine
     def handle_msg(self):
         is_deploying = self.redis.hget(DEPLOYING, self.params['public_ip'])
-        is_deployed  = self.redis.hget(DEPLOYED, self.params['public_ip'])
+        is_deployed  = DEPLOYED_CACHE.is_deployed(self.params['public_ip'])
 
         # 通知主机添加失败，后续需要将主机添加失败原因进行抽象分类告知用户
         message = {
@@ -99,7 +102,7 @@ class ServerNewHandler(WebSocketBaseHandler):
 
     def check(self):
         ''' 检查主机是否上报信息 '''
-        result = self.redis.hget(DEPLOYED, self.params['public_ip'])
+        result = DEPLOYED_CACHE.is_deployed(self.params['public_ip'])
 
         if result:
             self.write_message('success')
@@ -119,6 +122,8 @@ class ServerReport(BaseHandler):
         @apiName ServerReport
         @apiGroup Server
 
+        @apiDescription settings['report_queue']为True时只校验并放入上报队列, 返回202; 队列已满时返回503
+
         @apiParam {String} public_ip 公共ip
         @apiParam {Number} time 时间戳
         @apiParam {map[Number]Object} docker 容器
@@ -127,117 +132,119 @@ class ServerReport(BaseHandler):
         @apiParam {Object} disk Disk
         @apiParam {Object} net Net
         @apiParam {Object} system_load 负载
+        @apiParam {String} [k8s_deployment] k8s资源列表(kubectl get的输出, JSON或YAML), 同k8s_replicaset/k8s_pod/k8s_service/k8s_endpoint/k8s_ingress
 
         @apiUse Success
         """
         with catch(self):
-            deploying_msg = self.redis.hget(DEPLOYING, self.params['public_ip'])
-            is_deployed = self.redis.hget(DEPLOYED, self.params['public_ip'])
-
-            if not deploying_msg and not is_deployed:
-                raise ValueError('%s not in deploying/deployed' % self.params['public_ip'])
-
-            if deploying_msg:
-                data = json_loads(deploying_msg)
-                self.params.update({
-                    'name': data['name'],
-                    'cluster_id': data['cluster_id'],
-                    'lord': data['lord'],
-                    'form': data['form']
-                })
-
-                yield self.server_service.add_server(self.params)
-                yield self.server_service.save_server_account({'username': data['username'],
-                                                               'passwd': data['passwd'],
-                                                               'public_ip': data['public_ip']})
-                self.redis.hdel(DEPLOYING, self.params['public_ip'])
-                self.redis.hset(DEPLOYED, self.params['public_ip'], DEPLOYED_FLAG)
-
-                # 通知服务器创建成功消息
-                server_id = yield self.server_service.fetch_server_id(self.params['public_ip'])
-                instance_info = yield self.server_service.fetch_instance_info(server_id)
-                message = {
-                    'owner': data.get('owner'),
-                    'ip': self.params.get('public_ip'),
-                    'provider': instance_info['provider'],
-                    'tip': '{}'.format(data['lord'] if data['form'] == FORM_COMPANY else 0)
-                }
+            if settings.get('report_queue'):
+                self.server_report_service.validate(self.params)
+                self.server_report_service.enqueue([self.params])
+                self.set_status(202)
+            else:
+                yield self.server_report_service.handle_report(self.params)
 
-                # 添加非个人机器时给添加者授予新增主机的数据权限，并且也通知到管理员
-                if self.params['form'] == FORM_COMPANY:
-                    arg = {
-                        'cid': self.params['lord'],
-                        'uid': data.get('owner'),
-                        'sid': server_id
-                    }
-                    yield self.user_access_server_service.add(arg)
+            self.success()
 
-                    admin = yield self.company_employee_service.select(conds={'cid': self.params['lord'], 'is_admin': 1}, one=True)
-                    if data.get('owner') != admin['uid']:
-                        message['admin'] = admin['uid']
 
-                yield self.message_service.notify_server_added(message)
+class ServerBulkReport(BaseHandler):
+    def prepare(self):
+        ''' body可能是gzip压缩的, 由post逐个解析, 不在prepare中解析
+        '''
+        self.params = {'token': ''}
 
-            yield self.server_service.save_report(self.params)
+    @coroutine
+    def post(self):
+        """
+        @api {post} /remote/server/report/bulk 批量监控上报
+        @apiName ServerBulkReport
+        @apiGroup Server
 
-            # 将上报的k8s资源刷新到各个具体的对象表中
-            yield self.update_k8s_resource(self.params)
+        @apiDescription body为多个上报数据(格式同/remote/server/report, 可来自多台主机), JSON数组或每行一个JSON(NDJSON),
+                        Content-Encoding为gzip时按gzip解压. settings['report_queue']为True时只校验并放入上报队列, 返回202.
+                        解压后超过REPORT_BULK_MAX_SIZE字节时返回413, 数据格式错误时返回400, 上报队列已满时返回503(之前的数据已处理)
 
-            self.success()
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 200 OK
+            {
+                "status": 0,
+                "msg": "success",
+                "data": {
+                    "total": int,   # 上报数据条数
+                    "failed": int   # 处理失败(或校验失败)的条数
+                }
+            }
+        """
+        with catch(self):
+            gzipped = 'gzip' in self.request.headers.get('Content-Encoding', '')
+            total, failed, batch = 0, 0, []
+
+            for report in iter_reports(self.request.body, gzipped):
+                batch.append(report)
+
+                if len(batch) >= REPORT_BULK_BATCH:
+                    failed += yield self.handle_batch(batch)
+                    total, batch = total + len(batch), []
+
+            if batch:
+                failed += yield self.handle_batch(batch)
+                total += len(batch)
+
+            if settings.get('report_queue'):
+                self.set_status(202)
+
+            self.success({'total': total, 'failed': failed})
 
     @coroutine
-    def update_k8s_resource(self, params):
-        kv = {'k8s_deployment': 'deployment_service',
-              'k8s_service': 'service_service',
-              'k8s_ingress': 'ingress_service'}
-
-        for member in kv.keys():
-            if params.get(member):
-                verbose = yaml.load(params[member])
-
-                for item in verbose.get('items', []):
-                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get('labels') else ''
-                    obj_name = internal_name[internal_name.find('.')+1:]
-                    app_id = item['metadata']['labels'].get('app_id', 0) if item['metadata'].get('labels') else 0
-
-                    if app_id:
-                        yield getattr(self, kv[member]).update(sets={'verbose': yaml.dump(item, default_flow_style=False)},
-                                                               conds={'name': obj_name, 'app_id': int(app_id)})
-
-        # deployment下属资源: rs/pod
-        kv = {'k8s_replicaset': 'replicaset_service',
-              'k8s_pod': 'pod_service'}
-        for member in kv.keys():
-            if params.get(member):
-                verbose = yaml.load(params[member])
-
-                for item in verbose.get('items', []):
-                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get('labels') else ''
-                    deployment_name = internal_name[internal_name.find('.')+1:]
-                    deployment_info = yield self.deployment_service.select({'name': deployment_name}, one=True)
-
-                    if deployment_info:
-                        obj_name = item['metadata']['name'][item['metadata']['name'].find('.') + 1:]
-                        yield getattr(self, kv[member]).add_k8s_resource({'name': obj_name,
-                                                                          'deployment_id': deployment_info['id'],
-                                                                          'verbose': yaml.dump(item, default_flow_style=False)})
-
-        # service下属资源: endpoints
-        kv = {'k8s_endpoint': 'endpoint_service'}
-        for member in kv.keys():
-            if params.get(member):
-                verbose = yaml.load(params[member])
-
-                for item in verbose.get('items', []):
-                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get(
-                        'labels') else ''
-                    service_name = internal_name[internal_name.find('.') + 1:]
-                    service_info = yield self.service_service.select({'name': service_name}, one=True)
-
-                    if service_info:
-                        obj_name = item['metadata']['name'][item['metadata']['name'].find('.') + 1:]
-                        yield getattr(self, kv[member]).add_k8s_resource({'name': obj_name, 'service_id': service_info['id'],
-                                                                          'verbose': yaml.dump(item, default_flow_style=False)})
+    def handle_batch(self, batch):
+        '''
+        :return: 处理失败的条数
+        '''
+        if not settings.get('report_queue'):
+            failed = yield self.server_report_service.handle_batch(batch)
+            return failed
+
+        valid = []
+        for report in batch:
+            try:
+                self.server_report_service.validate(report)
+                valid.append(report)
+            except ValueError as e:
+                self.log.error(str(e))
+
+        if valid:
+            self.server_report_service.enqueue(valid)
+
+        return len(batch) - len(valid)
+
+
+class ServerReportQueueHandler(BaseHandler):
+    @is_login
+    def get(self):
+        """
+        @api {get} /api/server/report/queue 上报队列状态
+        @apiName ServerReportQueueHandler
+        @apiGroup Server
+
+        @apiDescription settings['report_queue']为True时上报队列的长度及worker最近一次记录的指标
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 200 OK
+            {
+                "status": 0,
+                "msg": "success",
+                "data": {
+                    "depth": int,       # 当前队列长度
+                    "lag": str,         # 最近一批最早入队的数据等待的秒数
+                    "processed": str,   # 累计处理条数
+                    "failed": str,      # 累计失败条数
+                    "time": str         # worker最近一次记录的时间戳
+                }
+            }
+        """
+        with catch(self):
+            self.success(self.server_report_service.get_queue_stats())
+
 
 class ServerDelHandler(BaseHandler):
     @require(RIGHT['delete_server'], service=SERVICE['s'])
@@ -405,9 +412,13 @@ class ServerPerformanceHandler(BaseHandler):
         @apiParam {Number} id 主机ID
         @apiParam {Number} start_time 起始时间
         @apiParam {Number} end_time 终止时间
-        @apiParam {Number} type 0: 机器详情 1: 正常 2: 按时平均 3: 按天平均
+        @apiParam {Number} type 0: 机器详情 1: 正常 2: 按时平均 3: 按天平均 4: 按时间跨度和点数自动选择分辨率(返回同0)
+        @apiParam {Number} [points] type为0/4时有效, 降采样返回的点数(最多1000), type为0不传时约返回7个点, type为4默认60
+        @apiParam {String} [sample] 降采样方式 avg: 桶内平均值(默认) max: 桶内最大值 lttb: 保留峰谷的原始点
         @apiParam {Number} now_page 当前页面
         @apiParam {Number} page_number 每页返回条数， 小于100条
+        @apiParam {String} [cursor] type为1/2/3时有效, 按游标分页: 第一页传空字符串, 之后传上一页返回的next_cursor,
+                                    此时返回{"data": [], "next_cursor": str}, 没有下一页时next_cursor为null
 
         @apiSuccessExample {json} Success-Response:
             HTTP/1.1 200 OK
@@ -618,8 +629,12 @@ class ServerContainerPerformanceHandler(BaseHandler):
         @apiParam {Number} start_time 起始时间
         @apiParam {Number} end_time 终止时间
         @apiParam {Number} type 0: 机器详情 1: 正常 2: 按时平均 3: 按天平均
+        @apiParam {Number} [points] type为0时有效, 降采样返回的点数(最多1000), 不传时约返回7个点
+        @apiParam {String} [sample] 降采样方式 avg: 桶内平均值(默认) max: 桶内最大值 lttb: 保留峰谷的原始点
         @apiParam {Number} now_page 当前页面
         @apiParam {Number} page_number 每页返回条数， 小于100条
+        @apiParam {String} [cursor] type为1/2/3时有效, 按游标分页: 第一页传空字符串, 之后传上一页返回的next_cursor,
+                                    此时返回{"data": [], "next_cursor": str}, 没有下一页时next_cursor为null
 
         @apiSuccessExample {json} Success-Response:
             HTTP/1.1 200 OK
@@ -648,6 +663,79 @@ class ServerContainerPerformanceHandler(BaseHandler):
             self.success(data)
 
 
+class ServerContainersPerformanceHandler(BaseHandler):
+    @require(service=SERVICE['s'])
+    @coroutine
+    def post(self):
+        """
+        @api {post} /api/server/containers/performance 获取主机所有容器降采样后的性能数据
+        @apiName ServerContainersPerformanceHandler
+        @apiGroup Server
+
+        @apiParam {Number} id 主机id
+        @apiParam {[]String} [container_names] 容器名字, 不传时返回全部容器
+        @apiParam {Number} start_time 起始时间
+        @apiParam {Number} end_time 终止时间
+        @apiParam {Number} [points] 每个容器返回的点数(最多1000), 默认60
+        @apiParam {String} [sample] 降采样方式 avg: 桶内平均值(默认) max: 桶内最大值 lttb: 保留峰谷的原始点
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 200 OK
+            {
+                "status": 0,
+                "msg": "success",
+                "data": {
+                    "container_name": {
+                        "cpu": [{"percent": float, "created_time": int}, ...],
+                        "memory": [{"percent": float, "created_time": int}, ...],
+                        "net": [{"input": float, "output": float, "created_time": int}, ...],
+                        "block": [{"input": float, "output": float, "created_time": int}, ...]
+                    },
+                    ...
+                }
+            }
+        """
+        with catch(self):
+            self.guarantee('id', 'start_time', 'end_time')
+
+            data = yield self.server_service.get_containers_performance(self.params)
+            self.success(data)
+
+
+class ServerRollupHandler(BaseHandler):
+    @require(service=SERVICE['s'])
+    @coroutine
+    def post(self):
+        """
+        @api {post} /api/server/rollup 获取主机当前时间段(未结束)的性能统计值
+        @apiName ServerRollupHandler
+        @apiGroup Server
+
+        @apiParam {Number} id 主机id
+        @apiParam {String} resolution 时间粒度 minute/hour/day
+
+        @apiSuccessExample {json} Success-Response:
+            HTTP/1.1 200 OK
+            {
+                "status": 0,
+                "msg": "success",
+                "data": {
+                    "start_time": int,
+                    "end_time": int,
+                    "count": int,
+                    "cpu_percent": {"avg": float, "min": float, "max": float, "std": float},
+                    "mem_percent": {"avg": float, "min": float, "max": float, "std": float},
+                    ...
+                }
+            }
+        """
+        with catch(self):
+            self.guarantee('id', 'resolution')
+
+            data = yield self.server_service.get_current_rollup(self.params)
+            self.success(data)
+
+
 class ServerContainersHandler(BaseHandler):
     @require(service=SERVICE['s'])
     @coroutine
@@ -911,6 +999,34 @@ class SystemLoadHandler(BaseHandler):
             self.success(info)
 
 
+class ServerReportDetailHandler(BaseHandler):
+    @require(service=SERVICE['s'])
+    @coroutine
+    def get(self, sid, field):
+        """
+        @api {get} /api/server/(\d+)/report/(\w+) 主机最新上报数据中列表不返回的字段
+        @apiName ServerReportDetailHandler
+        @apiGroup Server
+
+        @apiParam {number} sid 服务器id
+        @apiParam {String} field 上报字段, 目前只有docker
+
+        @apiSuccessExample {json} Success-Response:
+        HTTP/1.1 200 OK
+        {
+            "status": 0,
+            "msg": "success",
+            "data": {
+                "container_name": {"cpu": float, "mem_percent": float, ...},
+                ...
+            }
+        }
+        """
+        with catch(self):
+            data = yield self.server_service.get_report_detail(int(sid), field)
+            self.success(data)
+
+
 class ServerThresholdHandler(BaseHandler):
     @coroutine
     def get(self):
@@ -997,29 +1113,22 @@ class ServerMontiorHandler(BaseHandler):
                     )
             sids = [i['sid'] for i in sid if i and i.get('sid')]
 
-            faker_sids, real_sids = [], []
-            for sid in sids:
-                data = yield self.server_service.fetch_instance_info(sid)
-                if is_faker(data['instance_id']):
-                    faker_sids.append(sid)
-                else:
-                    real_sids.append(sid)
+            # 一次查询区分模拟数据的主机
+            servers = yield self.server_service.select(fields='id, name, instance_id', conds={'id': sids},
+                                                       ct=False, ut=False) if sids else []
+            fakers = {i['id']: i['name'] for i in servers if i['instance_id'] and is_faker(i['instance_id'])}
+            real_sids = [sid for sid in sids if sid not in fakers]
 
-            if faker_sids:
-                data = []
-                for sid in faker_sids:
-                    instance_info = yield self.server_service.fetch_instance_info(sid)
-                    server_info = yield self.server_service.select(conds={'id': sid}, fields='name', one=True)
-                    if instance_info and is_faker(instance_info['instance_id']):
-                        data.append(fake_systemload({'sid': int(sid), 'name': server_info['name'], 'monitor': True}))
+            if fakers:
+                data = [fake_systemload({'sid': int(sid), 'name': name, 'monitor': True}) for sid, name in fakers.items()]
 
-                real_data = yield self.server_service.get_monitor_data(real_sids)
+                real_data = yield self.server_service.get_monitor_data(real_sids, **self.get_lord())
                 data.extend(real_data)
 
                 self.success(data)
                 return
 
-            data = yield self.server_service.get_monitor_data(sids)
+            data = yield self.server_service.get_monitor_data(sids, **self.get_lord())
             self.success(data)
 
 
@@ -29,13 +29,13 @@ from handler.project.project import ProjectHandler, ProjectNewHandler, ProjectDe
     ProjectImageCloudDownload
 from handler.repository.repository import RepositoryHandler, RepositoryBranchHandler, GithubOauthCallbackHandler, \
     GithubOauthClearHandle
-from handler.server.server import ServerNewHandler, ServerReport, ServerDelHandler, \
-    ServerDetailHandler, ServerPerformanceHandler, ServerUpdateHandler, \
+from handler.server.server import ServerNewHandler, ServerReport, ServerBulkReport, ServerDelHandler, \
+    ServerReportQueueHandler, ServerDetailHandler, ServerPerformanceHandler, ServerUpdateHandler, \
     ServerStopHandler, ServerStartHandler, ServerRebootHandler, \
-    ServerStatusHandler, ServerContainerPerformanceHandler, ServerContainersHandler, \
+    ServerStatusHandler, ServerContainerPerformanceHandler, ServerContainersPerformanceHandler, ServerContainersHandler, \
     ServerContainersInfoHandler, ServerContainerStartHandler, ServerContainerStopHandler, \
     ServerContainerDelHandler, OperationLogHandler, SystemLoadHandler, ServerThresholdHandler,ServerMontiorHandler, \
-    ServerListHandler
+    ServerListHandler, ServerRollupHandler, ServerReportDetailHandler
 from handler.cloud.cloud import CloudsHandler, CloudCredentialHandler
 from handler.user.user import UserLoginHandler, UserLogoutHandler, UserSMSHandler, UserDetailHandler, \
                               UserUpdateHandler, UserUploadToken, GetCaptchaHandler, \
@@ -74,6 +74,7 @@ routes = [
     (r'/api/server/update', ServerUpdateHandler),
     (r'/api/server/performance', ServerPerformanceHandler),
     (r'/api/server/(\d+)/systemload', SystemLoadHandler),
+    (r'/api/server/(\d+)/report/(\w+)', ServerReportDetailHandler),
     (r'/api/server/monitor', ServerMontiorHandler),
     (r'/api/server/list', ServerListHandler),
 
@@ -88,6 +89,8 @@ routes = [
 
     (r'/api/server/containers/(\d+)', ServerContainersHandler),
     (r'/api/server/container/performance', ServerContainerPerformanceHandler),
+    (r'/api/server/containers/performance', ServerContainersPerformanceHandler),
+    (r'/api/server/rollup', ServerRollupHandler),
     (r'/api/server/container/start', ServerContainerStartHandler),
     (r'/api/server/container/stop', ServerContainerStopHandler),
     (r'/api/server/container/del', ServerContainerDelHandler),
@@ -97,6 +100,8 @@ routes = [
 
     # 主机相关之远程主机上报信息
     (r'/remote/server/report', ServerReport),
+    (r'/remote/server/report/bulk', ServerBulkReport),
+    (r'/api/server/report/queue', ServerReportQueueHandler),
 
     # 项目相关
     (r'/api/projects', ProjectHandler),
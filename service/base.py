@@ -22,7 +22,7 @@ from urllib.parse import urlencode
 from utils.db import DB, REDIS, SYNC_DB
 from utils.log import LOG
 from utils.ssh import SSH
-from utils.general import get_formats, get_in_formats, get_not_in_formats, choose_user_agent
+from utils.general import get_formats, get_in_formats, get_not_in_formats, choose_user_agent, gen_cursor, parse_cursor
 from constant import FULL_DATE_FORMAT, FULL_DATE_FORMAT_ESCAPE, POOL_COUNT, HTTP_TIMEOUT, ALIYUN_DOMAIN, NEG, \
                      DEFAULT_PAGE_NUM, MAX_PAGE_NUMBER
 
@@ -41,7 +41,7 @@ class BaseService():
     ############################################################################################
     @coroutine
     def select(self, conds=None, fields=None, ct=True, ut=True, df=None, one=False, extra='', page=None,
-               num=DEFAULT_PAGE_NUM):
+               num=DEFAULT_PAGE_NUM, order_by=None, cursor=None, desc=False):
         '''
         :param fields 字段名, str类型, 默认为类变量fields, 可传'id, name, ...'
         :param conds  条件, dict类型, 可传{'name': 'foo'}/{'name~': 'foo'} or {'age': [10, 20]}/{'age~': [10, 20]}
@@ -52,33 +52,42 @@ class BaseService():
         :param extra   额外
         :param page   页数
         :param num    每页消息数
+        :param order_by keyset分页的排序字段, 传入时按(order_by, id)排序分页, extra中不能再有ORDER BY/LIMIT
+        :param cursor   keyset分页时上一页返回的cursor, 第一页不传
+        :param desc     keyset分页是否降序
 
         Usage::
             >>> self.select(conds={'id': 1}, ct=False)
+            >>> self.select(conds={'owner': 1}, order_by='create_time', cursor=cursor, desc=True, num=20)
 
         :return: [{'id': 1, ...}, ...]
+                 keyset分页时为{'data': [{'id': 1, ...}, ...], 'cursor': 下一页的cursor or None, 'has_more': bool}
         '''
         conds, params = self.make_pair(conds)
 
         sql_params = self._create_query(fields=fields, conds=conds, params=params, ct=ct, ut=ut, df=df, extra=extra,
-                                        page=page, num=num)
+                                        page=page, num=num, order_by=order_by, cursor=cursor, desc=desc)
         cur = yield self.db.execute(*sql_params)
 
+        if order_by:
+            return self._keyset_result(cur.fetchall(), num)
+
         data = cur.fetchone() if one else cur.fetchall()
 
         return data
 
     def _create_query(self, fields=None, conds=None, params=None, ct=True, ut=True, df=None, extra='', page=None,
-                      num=DEFAULT_PAGE_NUM):
+                      num=DEFAULT_PAGE_NUM, order_by=None, cursor=None, desc=False):
         '''创建查询语句与参数, 供db.excute执行
            create_time, update_time比较特殊, 默认都有, 不需要时ct=False, ut=False
+           keyset分页时多查询一行用于判断是否还有下一页, 排序字段的原始值以_cursor_value, _cursor_id返回
 
         :return: sql or [sql, params]
         '''
         sql = "SELECT {fields} ".format(fields=fields or self.fields)
 
         if df is None:
-            df = FULL_DATE_FORMAT_ESCAPE if conds else FULL_DATE_FORMAT
+            df = FULL_DATE_FORMAT_ESCAPE if conds or (order_by and cursor) else FULL_DATE_FORMAT
 
         if ct:
             sql += ", DATE_FORMAT(create_time, '%s') AS create_time" % df
@@ -86,12 +95,29 @@ class BaseService():
         if ut:
             sql += ", DATE_FORMAT(update_time, '%s') AS update_time " % df
 
+        if order_by:
+            if not re.match(r'^\w+$', order_by):
+                raise ValueError('order_by错误')
+
+            sql += ", {field} AS _cursor_value, id AS _cursor_id ".format(field=order_by)
+
         sql += 'FROM {table} '.format(table=self.table)
 
-        if page:
-            page_num = int(num) if 0 < int(num) < MAX_PAGE_NUMBER else DEFAULT_PAGE_NUM
+        if page and not order_by:
+            page_num = self._page_num(num)
             extra += ' LIMIT {},{} '.format((int(page)-1)*page_num, page_num)
 
+        if order_by:
+            conds, params = list(conds or []), list(params or [])
+            op, direction = ('<', 'DESC') if desc else ('>', 'ASC')
+
+            if cursor:
+                value, last_id = parse_cursor(cursor)
+                conds.append('({f}{op}%s OR ({f}=%s AND id{op}%s))'.format(f=order_by, op=op))
+                params.extend([value, value, last_id])
+
+            extra += ' ORDER BY {f} {d}, id {d} LIMIT {n} '.format(f=order_by, d=direction, n=self._page_num(num) + 1)
+
         if not conds:
             sql_params = [sql+extra]
         else:
@@ -100,6 +126,24 @@ class BaseService():
 
         return sql_params
 
+    def _page_num(self, num):
+        return int(num) if 0 < int(num) < MAX_PAGE_NUMBER else DEFAULT_PAGE_NUM
+
+    def _keyset_result(self, rows, num):
+        ''' keyset分页: 多查询的一行说明还有下一页, 用本页最后一行生成下一页的cursor
+        '''
+        page_num = self._page_num(num)
+        has_more = len(rows) > page_num
+        rows = rows[:page_num]
+
+        cursor = gen_cursor([rows[-1]['_cursor_value'], rows[-1]['_cursor_id']]) if has_more else None
+
+        for row in rows:
+            row.pop('_cursor_value')
+            row.pop('_cursor_id')
+
+        return {'data': rows, 'cursor': cursor, 'has_more': has_more}
+
     ############################################################################################
     # DB ADD
     ############################################################################################
@@ -324,7 +368,7 @@ class BaseService():
         self.sync_db_execute(sql, s_params + c_params)
 
     def sync_select(self, conds=None, fields=None, ct=True, ut=True, df=None, one=False, extra='', page=None,
-                    num=DEFAULT_PAGE_NUM):
+                    num=DEFAULT_PAGE_NUM, order_by=None, cursor=None, desc=False):
         '''
         :param fields 字段名, str类型, 默认为类变量fields, 可传'id, name, ...'
         :param conds  条件, dict类型, 可传{'name': 'foo'}/{'name~': 'foo'} or {'age': [10, 20]}/{'age~': [10, 20]}
@@ -335,6 +379,7 @@ class BaseService():
         :param extra   额外
         :param page   页数
         :param num    每页消息数
+        :param order_by, cursor, desc 同select
 
         Usage::
             >>> self.select(conds={'id': 1}, ct=False)
@@ -344,10 +389,13 @@ class BaseService():
         conds, params = self.make_pair(conds)
 
         sql_params = self._create_query(fields=fields, conds=conds, params=params, ct=ct, ut=ut, df=df, extra=extra,
-                                        page=page, num=num)
+                                        page=page, num=num, order_by=order_by, cursor=cursor, desc=desc)
         cur = self.sync_db.cursor()
         cur.execute(*sql_params)
 
+        if order_by:
+            return self._keyset_result(cur.fetchall(), num)
+
         data = cur.fetchone() if one else cur.fetchall()
 
         return data
@@ -3,25 +3,12 @@ __author__ = 'Jon'
 from tornado.gen import coroutine
 
 from service.base import BaseService
-from utils.general import fuzzyfinder
 
 
 class ClusterService(BaseService):
     table  = 'cluster'
     fields = 'id, name, description, status, type, master_server_id'
 
-    def select_by_name(self, data, server_name):
-        names = []
-        sorted_data = dict()
-        for i in data:
-            key = i['name']
-            sorted_data[key] = i
-            names.append(key)
-
-        name_find = fuzzyfinder(server_name, names)
-        final_data = [sorted_data[key] for key in names if key in name_find]
-        return final_data
-
     @coroutine
     def get_all_providers(self, cluster_id):
         sql = """
@@ -0,0 +1,310 @@
+__author__ = 'Jon'
+
+'''
+主机上报的处理
+
+说明
+---------------
+* ServerReport/ServerBulkReport直接调用handle_report/handle_batch同步处理
+* settings['report_queue']为True时, handler只校验并enqueue, 由crontab/report_worker.py批量取出后调用handle_batch
+'''
+import time
+import traceback
+from tornado.gen import coroutine
+
+from service.base import BaseService
+from service.server.server import ServerService
+from service.application.deployment import DeploymentService, ReplicaSetService, PodService
+from service.application.service import ServiceService, EndpointService, IngressService
+from service.company.company_employee import CompanyEmployeeService
+from service.message.message import MessageService
+from service.permission.permission import UserAccessServerService
+from utils.general import json_loads, json_dumps, validate_ip
+from utils.report import load_k8s_items, dump_k8s_item, LRUCache
+from utils.deployed import DEPLOYED_CACHE
+from utils.error import AppError
+from constant import DEPLOYING, DEPLOYED, FORM_COMPANY, REPORT_QUEUE, REPORT_QUEUE_STATS, REPORT_QUEUE_MAX_LENGTH, \
+                     K8S_RESOURCE_DIGEST, K8S_RESOURCE_DIGEST_TIMEOUT, K8S_NAME_CACHE_TIMEOUT, K8S_NAME_CACHE_SIZE
+
+
+class ServerReportService(BaseService):
+    server_service = ServerService()
+    deployment_service = DeploymentService()
+    replicaset_service = ReplicaSetService()
+    pod_service = PodService()
+    service_service = ServiceService()
+    endpoint_service = EndpointService()
+    ingress_service = IngressService()
+    company_employee_service = CompanyEmployeeService()
+    message_service = MessageService()
+    user_access_server_service = UserAccessServerService()
+    name_cache = LRUCache(K8S_NAME_CACHE_SIZE)  # {(table, name): (id, 过期时间)}
+
+    @coroutine
+    def handle_report(self, params):
+        ''' 处理一次上报: 部署中的主机先入库, 然后保存上报信息并刷新k8s资源
+        '''
+        deploying_msg = None
+
+        # 已部署主机直接查进程内缓存, 只有缓存中没有的才查询redis
+        if not DEPLOYED_CACHE.is_deployed(params['public_ip']):
+            deploying_msg = self.redis.hget(DEPLOYING, params['public_ip'])
+            is_deployed = self.redis.hget(DEPLOYED, params['public_ip'])
+
+            if not deploying_msg and not is_deployed:
+                raise ValueError('%s not in deploying/deployed' % params['public_ip'])
+
+        if deploying_msg:
+            data = json_loads(deploying_msg)
+            params.update({
+                'name': data['name'],
+                'cluster_id': data['cluster_id'],
+                'lord': data['lord'],
+                'form': data['form']
+            })
+
+            yield self.server_service.add_server(params)
+            yield self.server_service.save_server_account({'username': data['username'],
+                                                           'passwd': data['passwd'],
+                                                           'public_ip': data['public_ip']})
+            self.redis.hdel(DEPLOYING, params['public_ip'])
+            DEPLOYED_CACHE.mark(params['public_ip'])
+
+            # 通知服务器创建成功消息
+            server_id = yield self.server_service.fetch_server_id(params['public_ip'])
+            instance_info = yield self.server_service.fetch_instance_info(server_id)
+            message = {
+                'owner': data.get('owner'),
+                'ip': params.get('public_ip'),
+                'provider': instance_info['provider'],
+                'tip': '{}'.format(data['lord'] if data['form'] == FORM_COMPANY else 0)
+            }
+
+            # 添加非个人机器时给添加者授予新增主机的数据权限，并且也通知到管理员
+            if params['form'] == FORM_COMPANY:
+                arg = {
+                    'cid': params['lord'],
+                    'uid': data.get('owner'),
+                    'sid': server_id
+                }
+                yield self.user_access_server_service.add(arg)
+
+                admin = yield self.company_employee_service.select(conds={'cid': params['lord'], 'is_admin': 1}, one=True)
+                if data.get('owner') != admin['uid']:
+                    message['admin'] = admin['uid']
+
+            yield self.message_service.notify_server_added(message)
+
+        yield self.server_service.save_report(params)
+
+        # 将上报的k8s资源刷新到各个具体的对象表中
+        yield self.update_k8s_resource(params)
+
+    @coroutine
+    def update_k8s_resource(self, params):
+        ''' 将上报的k8s资源刷新到各个具体的对象表中, 内容的digest与上次写入相同的对象不再写入
+        '''
+        changes = []
+
+        kv = {'k8s_deployment': 'deployment_service',
+              'k8s_service': 'service_service',
+              'k8s_ingress': 'ingress_service'}
+
+        for member in kv.keys():
+            if params.get(member):
+                for item, digest in load_k8s_items(params[member]):
+                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get('labels') else ''
+                    obj_name = internal_name[internal_name.find('.')+1:]
+                    app_id = item['metadata']['labels'].get('app_id', 0) if item['metadata'].get('labels') else 0
+
+                    if app_id:
+                        conds = {'name': obj_name, 'app_id': int(app_id)}
+                        changes.append(self._k8s_change(member, '{}:{}'.format(app_id, obj_name), item, digest,
+                                                        self._update_verbose, getattr(self, kv[member]), conds))
+
+        # deployment下属资源: rs/pod
+        kv = {'k8s_replicaset': 'replicaset_service',
+              'k8s_pod': 'pod_service'}
+        for member in kv.keys():
+            if params.get(member):
+                for item, digest in load_k8s_items(params[member]):
+                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get('labels') else ''
+                    deployment_name = internal_name[internal_name.find('.')+1:]
+                    deployment_id = yield self._fetch_id_by_name(self.deployment_service, deployment_name)
+
+                    if deployment_id:
+                        obj_name = item['metadata']['name'][item['metadata']['name'].find('.') + 1:]
+                        arg = {'name': obj_name, 'deployment_id': deployment_id}
+                        changes.append(self._k8s_change(member, '{}:{}'.format(deployment_id, obj_name), item, digest,
+                                                        self._add_verbose, getattr(self, kv[member]), arg))
+
+        # service下属资源: endpoints
+        kv = {'k8s_endpoint': 'endpoint_service'}
+        for member in kv.keys():
+            if params.get(member):
+                for item, digest in load_k8s_items(params[member]):
+                    internal_name = item['metadata']['labels'].get('internal_name', '') if item['metadata'].get(
+                        'labels') else ''
+                    service_name = internal_name[internal_name.find('.') + 1:]
+                    service_id = yield self._fetch_id_by_name(self.service_service, service_name)
+
+                    if service_id:
+                        obj_name = item['metadata']['name'][item['metadata']['name'].find('.') + 1:]
+                        arg = {'name': obj_name, 'service_id': service_id}
+                        changes.append(self._k8s_change(member, '{}:{}'.format(service_id, obj_name), item, digest,
+                                                        self._add_verbose, getattr(self, kv[member]), arg))
+
+        yield self._apply_k8s_changes(params['public_ip'], changes)
+
+    def _k8s_change(self, member, key, item, digest, func, service, arg):
+        ''' 一个待写入的k8s对象
+        :param member:  上报的字段, e.g. 'k8s_pod'
+        :param key:     对象在member中的唯一标识, e.g. '{deployment_id}:{name}'
+        :param item:    k8s对象
+        :param digest:  k8s对象内容的md5
+        :param func:    写入方法, _update_verbose/_add_verbose
+        :param service: 对象对应的service
+        :param arg:     func的参数
+        '''
+        return {
+            'field': '{}:{}'.format(member, key),
+            'digest': digest,
+            'item': item,
+            'func': func,
+            'service': service,
+            'arg': arg
+        }
+
+    @coroutine
+    def _apply_k8s_changes(self, public_ip, changes):
+        ''' 一次hmget取出主机上次写入的digest, 只写入内容变化了的对象
+
+            主机的K8S_RESOURCE_DIGEST整体替换为本次上报的对象, 已删除的对象不会一直留在redis中
+        '''
+        if not changes:
+            return
+
+        key = K8S_RESOURCE_DIGEST.format(public_ip=public_ip)
+        digests = self.redis.hmget(key, [c['field'] for c in changes])
+        seen = {}
+
+        try:
+            for change, digest in zip(changes, digests):
+                if change['digest'] != digest:
+                    verbose = dump_k8s_item(change['item'], change['digest'])
+                    yield change['func'](change['service'], change['arg'], verbose)
+                seen[change['field']] = change['digest']
+        finally:
+            # 写入失败及之后的对象不记录digest, 下次上报时重新写入
+            pipe = self.redis.pipeline()
+            pipe.delete(key)
+            if seen:
+                pipe.hmset(key, seen)
+                pipe.expire(key, K8S_RESOURCE_DIGEST_TIMEOUT)
+            pipe.execute()
+
+    @coroutine
+    def _update_verbose(self, service, conds, verbose):
+        yield service.update(sets={'verbose': verbose}, conds=conds)
+
+    @coroutine
+    def _add_verbose(self, service, params, verbose):
+        yield service.add_k8s_resource(dict(params, verbose=verbose))
+
+    @coroutine
+    def _fetch_id_by_name(self, service, name):
+        ''' 根据名称获取deployment/service的id, 进程内缓存K8S_NAME_CACHE_TIMEOUT秒, 不存在的名称也缓存
+        :return: id or None
+        '''
+        key = (service.table, name)
+        cache = self.name_cache.get(key)
+
+        if cache and cache[1] > time.time():
+            return cache[0]
+
+        data = yield service.select({'name': name}, fields='id', ct=False, ut=False, one=True)
+        obj_id = data['id'] if data else None
+        self.name_cache.set(key, (obj_id, time.time() + K8S_NAME_CACHE_TIMEOUT))
+
+        return obj_id
+
+    @coroutine
+    def handle_batch(self, batch):
+        ''' 按上报时间顺序处理, 同一主机只有最新一次上报的k8s信息需要保存, 之前的已过时
+        :return: 处理失败的条数
+        '''
+        batch.sort(key=lambda x: x.get('time', 0))
+        latest = {report.get('public_ip'): i for i, report in enumerate(batch)}
+
+        failed = 0
+        for i, report in enumerate(batch):
+            if latest[report.get('public_ip')] != i:
+                for k in [k for k in report if k.startswith('k8s_')]:
+                    report.pop(k)
+
+            try:
+                yield self.handle_report(report)
+            except Exception:
+                failed += 1
+                self.log.error(traceback.format_exc())
+
+        return failed
+
+    ############################################################################################
+    # 上报队列
+    ############################################################################################
+    def validate(self, params):
+        ''' 入队前的校验, 只检查必需的字段
+        '''
+        for arg in ['public_ip', 'time', 'cpu', 'memory', 'disk', 'net']:
+            if not params.get(arg):
+                raise ValueError('参数 %s 不能为空' % arg)
+
+        validate_ip(params['public_ip'])
+
+    def enqueue(self, reports):
+        ''' 上报数据入队, 记录入队时间用于计算队列延迟, 队列已满(worker跟不上)时抛出AppError(503)
+        :param reports: [{}, ...]
+        '''
+        if self.redis.llen(REPORT_QUEUE) + len(reports) > REPORT_QUEUE_MAX_LENGTH:
+            raise AppError('上报队列已满', code=503)
+
+        now = time.time()
+        for report in reports:
+            report['enqueue_time'] = now
+
+        self.redis.rpush(REPORT_QUEUE, *[json_dumps(report) for report in reports])
+
+    def dequeue(self, num):
+        ''' 原子地取出队首num条上报数据
+        :return: [{}, ...], 剩余队列长度
+        '''
+        pipe = self.redis.pipeline()
+        pipe.lrange(REPORT_QUEUE, 0, num - 1)
+        pipe.ltrim(REPORT_QUEUE, num, -1)
+        pipe.llen(REPORT_QUEUE)
+        reports, _, depth = pipe.execute()
+
+        return [json_loads(report) for report in reports], depth
+
+    def record_queue_stats(self, depth, lag=0, processed=0, failed=0):
+        ''' 记录队列指标
+        :param depth:     队列长度
+        :param lag:       本批最早入队的数据等待的秒数
+        :param processed: 本批处理条数
+        :param failed:    本批失败条数
+        '''
+        pipe = self.redis.pipeline()
+        pipe.hmset(REPORT_QUEUE_STATS, {'depth': depth, 'lag': round(lag, 3), 'time': int(time.time())})
+        pipe.hincrby(REPORT_QUEUE_STATS, 'processed', processed)
+        pipe.hincrby(REPORT_QUEUE_STATS, 'failed', failed)
+        pipe.execute()
+
+    def get_queue_stats(self):
+        ''' 当前队列长度及worker最近一次记录的指标
+        :return: {'depth': int, 'lag': str, 'processed': str, 'failed': str, 'time': str}
+        '''
+        data = self.redis.hgetall(REPORT_QUEUE_STATS)
+        data['depth'] = self.redis.llen(REPORT_QUEUE)
+
+        return data
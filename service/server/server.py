@@ -2,61 +2,209 @@ __author__ = 'Jon'
 
 import json
 import random
+import time
+import traceback
 from tornado.gen import coroutine, sleep
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 from service.base import BaseService
+from utils.db import DB, REDIS
+from utils.log import LOG
+from utils.deployed import DEPLOYED_CACHE
+from utils.latest import LATEST_STORE, LATEST_SQL
+from utils.name_index import NameIndex, bump_version
 from utils.general import get_formats
 from utils.aliyun import Aliyun
 from utils.qcloud import Qcloud
 from utils.zcloud import Zcloud
-from constant import UNINSTALL_CMD, DEPLOYED, LIST_CONTAINERS_CMD, START_CONTAINER_CMD, STOP_CONTAINER_CMD, \
+from constant import UNINSTALL_CMD, LIST_CONTAINERS_CMD, START_CONTAINER_CMD, STOP_CONTAINER_CMD, \
                      DEL_CONTAINER_CMD, CONTAINER_INFO_CMD, ALIYUN_NAME, QCLOUD_NAME, FULL_DATE_FORMAT, ZCLOUD_NAME, \
-                     SERVERS_REPORT_INFO, TCLOUD_STATUS, THRESHOLD, MONITOR_COLOR_TYPE, INSTANCE_STATUS
+                     SERVERS_REPORT_INFO, TCLOUD_STATUS, THRESHOLD, MONITOR_COLOR_TYPE, INSTANCE_STATUS, \
+                     REPORT_BUFFER_SIZE, REPORT_BUFFER_INTERVAL, REPORT_BUFFER_RETRIES, K8S_REPORT_DIGEST, K8S_REPORT_DIGEST_TIMEOUT, \
+                     K8S_REPORT_REFRESH_INTERVAL, SERVER_METRIC_RECENT, METRIC_RECENT_WINDOW, METRIC_RECENT_TOLERANCE, \
+                     MAX_SAMPLE_POINTS, SAMPLE_TYPES, METRIC_LTTB_FIELDS, \
+                     DEFAULT_SAMPLE_POINTS, METRIC_TIERS, SERVER_METRIC_COLUMNS, METRIC_ROLLUP_RESOLUTIONS, \
+                     METRIC_ROLLUP_TIMEOUT, REPORT_SUMMARY_FIELDS, REPORT_DETAIL_FIELDS, SERVER_REPORT_DETAIL, \
+                     SERVER_REPORT_DETAIL_TIMEOUT, SERVER_NAME_VERSION, MAX_PAGE_NUMBER, REPORT_FRESHNESS
 from utils.security import Aes
-from utils.general import get_in_formats, json_loads, json_dumps
+from utils.general import get_in_formats, json_loads, json_dumps, gen_md5, gen_cursor, parse_cursor
 from utils.faker import is_faker, fake_report_info, fake_performance
+from utils.metric import server_metric_fields, server_metric_values, server_metric_row, server_metric_content, \
+                         container_metric_fields, container_metric_values, container_metric_content, \
+                         server_metric_columns, container_metric_columns
+from utils.metric import ROLLUP_SCRIPT, rollup_bucket, rollup_key, parse_rollup, rollup_fields
+from utils.series import bucket_width, fill_buckets, bucket_points, lttb
+
+
+class ReportBuffer():
+    ''' 主机上报数据的写缓冲(write-behind)
+
+    说明
+    ---------------
+    * 所有主机的上报数据先按表缓存在进程内
+    * 缓存行数达到size, 或距离上次写入超过interval毫秒, 按表以多行INSERT写入
+    * 进程退出前需要调用flush, 见app.py
+    * 写入失败的语句随之后的写入重试, 最多retries次, 之后丢弃并记录丢弃的行数
+    * self.stats记录写入次数/行数/耗时, 每次写入后输出到stats日志
+    '''
+    def __init__(self, size=REPORT_BUFFER_SIZE, interval=REPORT_BUFFER_INTERVAL, retries=REPORT_BUFFER_RETRIES):
+        self.db = DB
+        self.log = LOG
+        self.size = size
+        self.interval = interval
+        self.retries = retries
+        self.rows = {}
+        self.count = 0
+        self.failed = []  # [(table, fields, chunk, 已重试次数), ...]
+        self.periodic = None
+        self.stats = {
+            'flush_count': 0,    # 写入次数
+            'flush_rows': 0,     # 累计写入行数
+            'last_rows': 0,      # 最近一次写入行数
+            'max_rows': 0,       # 单次写入最大行数
+            'last_cost': 0,      # 最近一次写入耗时(毫秒)
+            'max_cost': 0,       # 单次写入最大耗时(毫秒)
+            'error_count': 0,    # 写入失败的语句数
+            'retry_rows': 0,     # 累计重试的行数
+            'dropped_rows': 0    # 重试retries次后仍失败而丢弃的行数
+        }
+
+    def add(self, table, fields, row):
+        '''
+        :param table:  表名, e.g. 'cpu'
+        :param fields: 字段, e.g. 'public_ip, created_time, content'
+        :param row:    字段对应的值, e.g. ['1.1.1.1', 1520000000, '{}']
+        '''
+        if self.periodic is None:
+            self.periodic = PeriodicCallback(self.flush, self.interval)
+            self.periodic.start()
+
+        self.rows.setdefault((table, fields), []).append(row)
+        self.count += 1
+
+        if self.count >= self.size:
+            IOLoop.current().spawn_callback(self.flush)
+
+    @coroutine
+    def flush(self):
+        ''' 把缓存的数据写入数据库, 每条语句最多size行
+        '''
+        if not self.count and not self.failed:
+            return
+
+        rows, count, failed = self.rows, self.count, self.failed
+        self.rows, self.count, self.failed = {}, 0, []
+
+        chunks = [(table, fields, values[i:i+self.size], 0)
+                  for (table, fields), values in rows.items() for i in range(0, len(values), self.size)]
+        self.stats['retry_rows'] += sum(len(chunk) for _, _, chunk, _ in failed)
+
+        start = time.time()
+        for table, fields, chunk, attempts in failed + chunks:
+            formats = ','.join(['(' + get_formats(chunk[0]) + ')'] * len(chunk))
+            sql = 'INSERT INTO {table}({fields}) VALUES {formats}'.format(table=table, fields=fields, formats=formats)
+
+            try:
+                yield self.db.execute(sql, [v for row in chunk for v in row])
+            except Exception:
+                self.stats['error_count'] += 1
+                if attempts < self.retries:
+                    self.failed.append((table, fields, chunk, attempts + 1))
+                    self.log.error('{}: {} rows will be retried\n{}'.format(table, len(chunk), traceback.format_exc()))
+                else:
+                    self.stats['dropped_rows'] += len(chunk)
+                    self.log.error('{}: {} rows dropped after {} retries\n{}'.format(
+                        table, len(chunk), attempts, traceback.format_exc()))
+
+        cost = int((time.time() - start) * 1000)
+        self.stats['flush_count'] += 1
+        self.stats['flush_rows'] += count
+        self.stats['last_rows'] = count
+        self.stats['max_rows'] = max(self.stats['max_rows'], count)
+        self.stats['last_cost'] = cost
+        self.stats['max_cost'] = max(self.stats['max_cost'], cost)
+
+        self.log.stats({'report_buffer': self.stats})
+
 
 class ServerService(BaseService):
     table = 'server'
     fields = 'id, name, public_ip, business_status, cluster_id, instance_id, lord, form'
+    report_buffer = ReportBuffer()
+    rollup_script = REDIS.register_script(ROLLUP_SCRIPT)
+    name_indexes = {}  # {(lord, form): NameIndex}
 
     @coroutine
     def save_report(self, params):
-        """ 保存主机上报的信息
+        """ 保存主机上报的信息, 性能数据经由report_buffer批量写入
         """
         base_data = [params['public_ip'], params['time']]
-        base_sql = 'INSERT INTO %s(public_ip, created_time,content)'
-        suffix = ' values(%s,%s,%s)'
-        for table in ['cpu', 'memory', 'disk', 'net']:
-            content = json.dumps(params[table])
-            sql = (base_sql % table) + suffix
-            yield self.db.execute(sql, base_data + [content])
+        values = server_metric_values(params)
+        self.report_buffer.add('server_metric', 'public_ip, created_time, ' + server_metric_fields(),
+                               base_data + values)
+        # 最近数据/累计值/最新上报数据在同一个pipeline中写入redis
+        pipe = self.redis.pipeline()
+        self._save_recent_report(pipe, params['public_ip'], params['time'], values)
+        self._save_rollup(pipe, params['public_ip'], params['time'], values)
 
         if params.get('docker'):
             for (k, v) in params['docker'].items():
-                self._save_docker_report(base_data + [k] + [json.dumps(v)])
+                self._save_docker_report(base_data + [k] + container_metric_values(v))
+
+        # 保存最新至redis, 摘要与其它字段分开保存; 不修改params, 之后的k8s资源刷新还需要public_ip
+        public_ip = params['public_ip']
+        report = json_dumps({k: params.get(k) for k in REPORT_SUMMARY_FIELDS})
+        detail = {k: json_dumps(params[k]) for k in REPORT_DETAIL_FIELDS if params.get(k)}
+        detail_key = SERVER_REPORT_DETAIL.format(public_ip=public_ip)
+
+        pipe.hset(SERVERS_REPORT_INFO, public_ip, report)
+        LATEST_STORE.save_report(pipe, public_ip, report)
+        pipe.delete(detail_key)
+        if detail:
+            pipe.hmset(detail_key, detail)
+            pipe.expire(detail_key, SERVER_REPORT_DETAIL_TIMEOUT)
+        pipe.execute()
 
         yield self._save_k8s_report(params)
 
-        # 保存最新至redis
-        public_ip = params.pop('public_ip')
-        self.redis.hset(SERVERS_REPORT_INFO, public_ip, json_dumps(params))
+    @coroutine
+    def get_report_detail(self, server_id, field):
+        ''' 主机最新上报数据中摘要以外的字段
+        :param field: REPORT_DETAIL_FIELDS之一, e.g. 'docker'
+        :return: 上报的内容, 没有时为{}
+        '''
+        if field not in REPORT_DETAIL_FIELDS:
+            raise ValueError('field只能是{}'.format('/'.join(REPORT_DETAIL_FIELDS)))
+
+        public_ip = yield self.fetch_public_ip(server_id)
+        return json_loads(self.redis.hget(SERVER_REPORT_DETAIL.format(public_ip=public_ip), field))
 
     @coroutine
     def _save_k8s_report(self, params):
-        kv = {}
+        ''' 只保存内容(digest)有变化的k8s信息, 没有变化时每K8S_REPORT_REFRESH_INTERVAL秒刷新一次update_time
+        '''
+        now = int(time.time())
+        key = K8S_REPORT_DIGEST.format(public_ip=params['public_ip'])
+        last = self.redis.hgetall(key)
+        refresh = int(last.get('refresh_time', 0)) + K8S_REPORT_REFRESH_INTERVAL <= now
+
+        kv, digests = {}, {}
 
         for member in ['k8s_node', 'k8s_pod', 'k8s_deployment', 'k8s_service', 'k8s_replicaset']:
             if params.get(member):
-                kv[member] = params.get(member)
+                digest = gen_md5(params[member].encode())
+
+                if digest != last.get(member):
+                    kv[member] = params.get(member)
+                    digests[member] = digest
 
         if kv:
-            key = ','.join(kv.keys())
+            key_fields = ','.join(kv.keys())
             value = ','.join(['%s'] * len(kv))
             sets, sets_params = self.make_pair(kv)
 
             sql = "INSERT INTO k8s (public_ip, {fields}) VALUES (%s, {value})" \
-                  " ON DUPLICATE KEY UPDATE update_time=NOW(),".format(fields=key, value=value)
+                  " ON DUPLICATE KEY UPDATE update_time=NOW(),".format(fields=key_fields, value=value)
             sql += ','.join(sets)
 
             yield self.db.execute(sql, [params['public_ip']] + sets_params + sets_params)
@@ -66,11 +214,72 @@ class ServerService(BaseService):
                       " ON DUPLICATE KEY UPDATE update_time=NOW(), node=%s"
                 yield self.db.execute(sql, [params['public_ip'], kv['k8s_node'], kv['k8s_node']])
 
+        elif not (refresh and last):
+            return
+
+        # 到了刷新时间, 本次没有写入的表也刷新update_time(有变化时k8s表已写入)
+        if refresh and last:
+            tables = ['k8s_node'] if kv else ['k8s', 'k8s_node']
+            for table in [t for t in tables if not kv.get(t)]:
+                yield self.db.execute('UPDATE {table} SET update_time=NOW() WHERE public_ip=%s'.format(table=table),
+                                      [params['public_ip']])
+
+        # 只有k8s/k8s_node两个表的update_time都刷新了才重新计时, 否则k8s_node可能一直等不到刷新
+        if (refresh and last) or kv.get('k8s_node'):
+            digests['refresh_time'] = now
+
+        pipe = self.redis.pipeline()
+        pipe.hmset(key, digests)
+        pipe.expire(key, K8S_REPORT_DIGEST_TIMEOUT)
+        pipe.execute()
+
+    def _save_recent_report(self, pipe, public_ip, created_time, values):
+        ''' 在pipe中写入: 最近METRIC_RECENT_WINDOW秒的性能数据同时保存在redis的zset中, 用于最近时间段的查询
+        '''
+        key = SERVER_METRIC_RECENT.format(public_ip=public_ip)
+
+        pipe.zadd(key, created_time, json_dumps([created_time] + values))
+        pipe.zremrangebyscore(key, '-inf', '({}'.format(created_time - METRIC_RECENT_WINDOW))
+        pipe.expire(key, METRIC_RECENT_WINDOW)
+
+    def _save_rollup(self, pipe, public_ip, created_time, values):
+        ''' 在pipe中写入: 累计各时间粒度(分钟/小时/天)的count/sum/sumsq/min/max
+            crontab/sync_server_log.py据分钟的累计值保存汇总数据, 小时/天只供get_current_rollup查询
+        '''
+        keys, timeouts = [], []
+        for resolution, seconds in METRIC_ROLLUP_RESOLUTIONS.items():
+            bucket = rollup_bucket(created_time, seconds)
+            keys.append(rollup_key(resolution, bucket))
+            timeouts.append(max(bucket + seconds + METRIC_ROLLUP_TIMEOUT - int(time.time()), 1))
+
+        args = [public_ip]
+        for col, value in zip(server_metric_columns(), values):
+            args.extend([col, value])
+
+        self.rollup_script(keys=keys, args=timeouts + args, client=pipe)
+
     @coroutine
+    def get_current_rollup(self, params):
+        ''' 主机当前(未结束)时间段的统计值
+        :param params: {'id': 主机id, 'resolution': minute/hour/day}
+        :return: {'start_time': int, 'end_time': int, 'count': int, col: {'avg', 'min', 'max', 'std'}, ...}
+        '''
+        seconds = METRIC_ROLLUP_RESOLUTIONS.get(params.get('resolution'))
+        if not seconds:
+            raise ValueError('resolution只能是{}'.format('/'.join(METRIC_ROLLUP_RESOLUTIONS)))
+
+        public_ip = yield self.fetch_public_ip(params['id'])
+        bucket = rollup_bucket(time.time(), seconds)
+        fields = rollup_fields(public_ip)
+        data = parse_rollup(dict(zip(fields, self.redis.hmget(rollup_key(params['resolution'], bucket), fields))))
+
+        result = data.get(public_ip, {'count': 0})
+        result.update({'start_time': bucket, 'end_time': bucket + seconds})
+        return result
+
     def _save_docker_report(self, params):
-        sql = "INSERT INTO docker_stat(public_ip, created_time, container_name,  content)" \
-            "VALUES(%s, %s, %s, %s)"
-        yield self.db.execute(sql, params)
+        self.report_buffer.add('container_metric', 'public_ip, created_time, container_name, ' + container_metric_fields(),
+                               params)
 
     @coroutine
     def save_server_account(self, params):
@@ -94,12 +303,52 @@ class ServerService(BaseService):
               " VALUES(%s, %s, %s, %s, %s, %s)"
 
         yield self.db.execute(sql, [params['name'], params['public_ip'], params['cluster_id'], instance_id, params['lord'], params['form']])
+        yield self.refresh_latest(public_ip=params['public_ip'])
+        bump_version(self.redis, [params])
+
+    @coroutine
+    def refresh_latest(self, **cond):
+        ''' 刷新主机在LATEST_STORE中的主机与实例信息
+        :param cond: {'public_ip': str} or {'id': int or [int, ...]}
+        '''
+        conds, arg = self.make_pair({'s.' + k: v for k, v in cond.items()})
+        cur = yield self.db.execute(LATEST_SQL.format(where='WHERE ' + ' AND '.join(conds)), arg)
+        LATEST_STORE.save(cur.fetchall())
+
+    @coroutine
+    def update(self, sets=None, conds=None):
+        ''' 同BaseService.update, 之后刷新被修改主机在LATEST_STORE中的信息 '''
+        servers = yield self.select(conds=conds, fields='id, public_ip, lord, form', ct=False, ut=False)
+        yield super().update(sets=sets, conds=conds)
+
+        if not servers:
+            return
+
+        if 'public_ip' in (sets or {}):
+            for server in servers:
+                LATEST_STORE.remove(server['public_ip'])
+
+        yield self.refresh_latest(id=[server['id'] for server in servers])
+        if 'name' in (sets or {}):
+            bump_version(self.redis, servers)
+
+    @coroutine
+    def delete(self, conds=None):
+        ''' 同BaseService.delete, 之后从LATEST_STORE中删除这些主机 '''
+        servers = yield self.select(conds=conds, fields='public_ip, lord, form', ct=False, ut=False)
+        yield super().delete(conds=conds)
+
+        for server in servers:
+            LATEST_STORE.remove(server['public_ip'])
+        if servers:
+            bump_version(self.redis, servers)
 
     @coroutine
     def migrate_server(self, params):
         sql = " UPDATE server SET cluster_id=%s WHERE id IN (%s) " % (params['cluster_id'], get_formats(params['id']))
 
         yield self.db.execute(sql, params['id'])
+        yield self.refresh_latest(id=params['id'])
 
     @coroutine
     def fetch_ssh_login_info(self, params):
@@ -135,6 +384,7 @@ class ServerService(BaseService):
     @coroutine
     def _delete_server(self, server_id):
         params = yield self.fetch_ssh_login_info({'server_id': server_id})
+        tenant = yield self.select(conds={'id': server_id}, fields='lord, form', ct=False, ut=False, one=True)
 
         params['cmd'] = UNINSTALL_CMD
         yield self.remote_ssh(params)
@@ -142,7 +392,10 @@ class ServerService(BaseService):
         for table in ['server', 'server_account']:
             yield self._delete_server_info(table, params['public_ip'])
 
-        self.redis.hdel(DEPLOYED, params['public_ip'])
+        DEPLOYED_CACHE.unmark(params['public_ip'])
+        LATEST_STORE.remove(params['public_ip'])
+        if tenant:
+            bump_version(self.redis, [tenant])
 
     @coroutine
     def delete_server(self, params):
@@ -154,67 +407,147 @@ class ServerService(BaseService):
         sql = " UPDATE server SET name=%s WHERE id=%s "
 
         yield self.db.execute(sql, [params['name'], params['id']])
+        yield self.refresh_latest(id=params['id'])
+
+        tenant = yield self.select(conds={'id': params['id']}, fields='lord, form', ct=False, ut=False, one=True)
+        if tenant:
+            bump_version(self.redis, [tenant])
 
     @coroutine
     def get_brief_list(self, **cond):
-        ''' 集群详情中获取主机列表
+        ''' 集群详情中获取主机列表, 从LATEST_STORE读取, 租户在其中还没有全量重建过时查询数据库
+        :param cond: {'lord', 'form', 'cluster_id'(可选), 'provider'(可选), 'region'(可选)}, provider/region可以是列表
         '''
-        arg = []
-        extra = ''
+        servers = LATEST_STORE.load(cond['lord'], cond['form']) if cond.get('lord') else None
+        if servers is None:
+            data = yield self._get_brief_list(**cond)
+            return data
 
-        if len(cond) > 1: # 暂时保留cluster_id，但实际没用到
-            extra = 'WHERE '
-            e = []
+        def match(value, contents):
+            return not contents or (value in contents if isinstance(contents, list) else value == contents)
 
-            if cond.get('provider'):
-                e.append(get_in_formats(field='i.provider', contents=cond['provider']))
-                if isinstance(cond['provider'], list):
-                    arg.extend(cond['provider'])
-                else:
-                    arg.append(cond['provider'])
+        data = []
+        for server in servers:
+            if not (match(server['provider'], cond.get('provider')) and match(server['address'], cond.get('region'))
+                    and match(str(server['cluster_id']), cond.get('cluster_id') and str(cond['cluster_id']))):
+                continue
 
-            if cond.get('region'):
-                e.append(get_in_formats(field='i.region_name', contents=cond['region']))
-                if isinstance(cond['region'], list):
-                    arg.extend(cond['region'])
-                else:
-                    arg.append(cond['region'])
+            d = {k: server[k] for k in ['id', 'name', 'public_ip', 'cluster_id', 'instance_id', 'provider',
+                                        'instance_name', 'address', 'machine_status']}
+            d.update(fake_report_info() if is_faker(d['instance_id']) else server['report'])
+            data.append(d)
 
-            if cond.get('cluster_id'):
-                e.append('s.cluster_id=%s')
-                arg.append(cond['cluster_id'])
+        data = sorted(data, key=lambda x: x['name'], reverse=True)
+        return data
 
-            if cond.get('lord'):
-                e.append('s.lord=%s')
-                arg.append(cond['lord'])
+    def _brief_where(self, access_uid=None, ids=None, **cond):
+        ''' 主机列表的查询条件
+        :param access_uid: 公司非管理员的用户id, 只查询其有权限的主机
+        :param ids:        只查询这些主机
+        :return: 'WHERE ...' or '', [参数]
+        '''
+        e, arg = [], []
 
-            if cond.get('form'):
-                e.append('s.form=%s')
-                arg.append(cond['form'])
+        if ids:
+            e.append(get_in_formats(field='s.id', contents=ids))
+            arg.extend(ids)
 
-            extra += ' AND '.join(e)
+        for k, field in [('provider', 'i.provider'), ('region', 'i.region_name')]:
+            if cond.get(k):
+                contents = cond[k] if isinstance(cond[k], list) else [cond[k]]
+                e.append(get_in_formats(field=field, contents=contents))
+                arg.extend(contents)
 
+        for k in ['cluster_id', 'lord', 'form']:
+            if cond.get(k):
+                e.append('s.{}=%s'.format(k))
+                arg.append(cond[k])
+
+        if access_uid:
+            e.append('s.id IN (SELECT sid FROM user_access_server WHERE uid=%s AND cid=%s)')
+            arg.extend([access_uid, cond['lord']])
+
+        return ('WHERE ' + ' AND '.join(e) if e else ''), arg
+
+    def _add_report_info(self, data):
+        ''' 一次hmget取出data中各主机的最新上报信息并合并到data中
+        '''
+        if not data:
+            return
+
+        reports = self.redis.hmget(SERVERS_REPORT_INFO, [d['public_ip'] for d in data])
+        for d, report in zip(data, reports):
+            d.update(fake_report_info() if is_faker(d['instance_id']) else json_loads(report))
+
+    @coroutine
+    def _get_brief_list(self, **cond):
+        where, arg = self._brief_where(**cond)
         sql = """
             SELECT s.id, s.name, s.public_ip, s.cluster_id, i.instance_id, i.provider, i.instance_name, i.region_name AS address, i.status AS machine_status
             FROM server s
             JOIN instance i USING(instance_id)
-            """+"""
             {where}
-            ORDER BY i.provider
-        """.format(where=extra)
+            ORDER BY s.name DESC, i.provider
+        """.format(where=where)
 
         cur = yield self.db.execute(sql, arg)
         data = cur.fetchall()
 
         # 添加最新上报信息
-        report_info = self.redis.hgetall(SERVERS_REPORT_INFO)
-        for d in data:
-            info = fake_report_info() if is_faker(d['instance_id']) else json_loads(report_info.get(d['public_ip']))
-            d.update(info)
-
-        data = sorted(data, key=lambda x: x['name'], reverse=True)
+        self._add_report_info(data)
         return data
 
+    @coroutine
+    def search_name(self, lord, form, server_name):
+        ''' 用进程内的主机名索引查找名称包含server_name的主机, 租户的版本号变化后重建索引
+        :return: [id, ...]
+        '''
+        version = self.redis.get(SERVER_NAME_VERSION.format(lord=lord, form=form)) or '0'
+        index = self.name_indexes.get((lord, form))
+
+        if index is None or index.version != version:
+            servers = yield self.select(conds={'lord': lord, 'form': form}, fields='id, name', ct=False, ut=False)
+            index = NameIndex(servers, version)
+            self.name_indexes[(lord, form)] = index
+
+        return index.search(server_name)
+
+    @coroutine
+    def get_brief_page(self, page, page_num, access_uid=None, server_name=None, **cond):
+        ''' 分页获取主机列表, 权限过滤/排序/分页都在数据库中完成, 只取出当页主机的上报信息
+        :param access_uid:  公司非管理员的用户id, 只返回其有权限的主机
+        :param server_name: 只返回名称包含server_name的主机, 先由主机名索引得到id
+        :param cond:        同get_brief_list
+        :return: {'data': [...], 'total': 符合条件的主机总数}
+        '''
+        ids = None
+        if server_name:
+            ids = yield self.search_name(cond['lord'], cond['form'], server_name)
+            if not ids:
+                return {'data': [], 'total': 0}
+
+        where, arg = self._brief_where(access_uid=access_uid, ids=ids, **cond)
+        # 超过上限时按上限返回, 不退回默认的条数
+        page_num = self._page_num(min(int(page_num), MAX_PAGE_NUMBER - 1))
+
+        sql = """
+            SELECT s.id, s.name, s.public_ip, s.cluster_id, i.instance_id, i.provider, i.instance_name, i.region_name AS address, i.status AS machine_status
+            FROM server s
+            JOIN instance i USING(instance_id)
+            {where}
+            ORDER BY s.name DESC, s.id DESC
+            LIMIT %s, %s
+        """.format(where=where)
+        cur = yield self.db.execute(sql, arg + [(max(int(page), 1) - 1) * page_num, page_num])
+        data = cur.fetchall()
+
+        sql = " SELECT COUNT(*) AS total FROM server s JOIN instance i USING(instance_id) {where} ".format(where=where)
+        cur = yield self.db.execute(sql, arg)
+        total = cur.fetchone()['total']
+
+        self._add_report_info(data)
+        return {'data': data, 'total': total}
+
     @coroutine
     def get_detail(self, id):
         ''' 获取主机详情
@@ -235,21 +568,156 @@ class ServerService(BaseService):
 
         return data
 
+    def _get_recent_performance(self, params):
+        ''' 查询范围在SERVER_METRIC_RECENT保留的时间跨度内时, 直接从redis返回, 取点方式同_get_performance
+        :return: {'cpu': [], 'memory': [], 'disk': [], 'net': []}, 数据不完整时返回None
+        '''
+        start_time, end_time = int(params['start_time']), int(params['end_time'])
+        if start_time < time.time() - METRIC_RECENT_WINDOW:
+            return None
+
+        key = SERVER_METRIC_RECENT.format(public_ip=params['public_ip'])
+
+        pipe = self.redis.pipeline()
+        pipe.zrange(key, 0, 0, withscores=True)
+        pipe.zrevrangebyscore(key, '({}'.format(end_time), start_time)
+        first, samples = pipe.execute()
+
+        if not first or first[0][1] > start_time + METRIC_RECENT_TOLERANCE:
+            return None
+
+        if not params.get('points'):
+            step = len(samples)//7
+            if step:
+                samples = [samples[i] for i in range(0, len(samples), step)]
+
+        rows = []
+        for sample in reversed(samples):
+            sample = json_loads(sample)
+            rows.append(dict(server_metric_row(sample[1:]), created_time=sample[0]))
+
+        return self._server_metric_points(rows, params)
+
+    def _server_metric_points(self, rows, params=None):
+        ''' server_metric表的数据按cpu/memory/disk/net拆分, params中有points时先在内存中降采样
+        :return: {'cpu': [], 'memory': [], 'disk': [], 'net': []}
+        '''
+        data = {}
+        for table in ['cpu', 'memory', 'disk', 'net']:
+            table_rows = rows
+            if params and params.get('points'):
+                table_rows = self._sample_rows(rows, server_metric_columns(table), METRIC_LTTB_FIELDS[table], params)
+            data[table] = [self._server_metric_point(row, table) for row in table_rows]
+        return data
+
+    def _server_metric_point(self, row, table):
+        content = server_metric_content(row, table)
+        content['created_time'] = row['created_time']
+        return content
+
+    def _parse_sample(self, params):
+        ''' 校验降采样参数, points: 返回的点数, sample: avg/max/lttb(默认avg)
+        '''
+        if not params.get('points'):
+            return
+
+        params['start_time'], params['end_time'] = int(params['start_time']), int(params['end_time'])
+        params['points'] = min(int(params['points']), MAX_SAMPLE_POINTS)
+        params['sample'] = params.get('sample') or SAMPLE_TYPES[0]
+
+        if params['points'] <= 0:
+            raise ValueError('points必须大于0')
+
+        if params['sample'] not in SAMPLE_TYPES:
+            raise ValueError('sample只能是{}'.format('/'.join(SAMPLE_TYPES)))
+
+    def _sample_rows(self, rows, fields, lttb_fields, params):
+        ''' 在内存中对按时间升序的原始数据降采样
+        '''
+        if params['sample'] == 'lttb':
+            return lttb(rows, params['points'], key=lambda x: sum(x[f] for f in lttb_fields))
+
+        return bucket_points(rows, params['start_time'], params['end_time'], params['points'], fields, params['sample'])
+
     @coroutine
-    def _get_performance(self, table, params):
-        """
-        :param table: cpu/memory/disk
-        :param params: {'public_ip': str, 'start_time': timestamp, 'end_time': timestamp}
+    def _get_sampled_metric(self, table, fields, lttb_fields, where, arg, params):
+        ''' 降采样查询性能数据
+            avg/max: 在数据库中按时间分成points个桶聚合, 正好返回points个点(空桶的值为None)
+            lttb: 取出时间段内的原始数据, 选出points个保留峰谷的点
+
+        :param table:       server_metric/container_metric
+        :param fields:      需要的字段, e.g. ['cpu_percent']
+        :param lttb_fields: lttb取点的依据
+        :param where:       查询条件, e.g. 'public_ip=%s'
+        :param arg:         where的参数
+        :return: [{'created_time': int, field: 值, ...}, ...]
+        '''
+        if params['sample'] == 'lttb':
+            rows = yield self._get_raw_metric(table, fields, where, arg, params)
+            return self._sample_rows(rows, fields, lttb_fields, params)
+
+        rows = yield self._get_bucket_metric(table, fields, where, arg, params)
+        return rows
+
+    @coroutine
+    def _get_raw_metric(self, table, fields, where, arg, params, group=None):
+        ''' 时间段内的全部原始数据, 按时间升序
+        :param group: 分组字段, e.g. 'container_name', 传入时先按group排序
+        '''
+        sql = """
+            SELECT {group} created_time, {fields} FROM {table}
+            WHERE {where} AND created_time>=%s AND created_time<%s
+            ORDER BY {group} created_time
+        """.format(table=table, fields=', '.join(fields), where=where, group=group + ',' if group else '')
+        cur = yield self.db.execute(sql, arg + [params['start_time'], params['end_time']])
+        return cur.fetchall()
+
+    @coroutine
+    def _get_bucket_metric(self, table, fields, where, arg, params, group=None):
+        ''' 在数据库中按时间分成points个桶, 每个桶取avg/max
+        :param group: 分组字段, e.g. 'container_name', 传入时按(group, 桶)聚合, 返回的数据不补齐空桶
+        '''
+        start_time, end_time, num = params['start_time'], params['end_time'], params['points']
+        agg = params['sample'].upper()
+        sql = """
+            SELECT {group} FLOOR((created_time-%s)/%s) AS bucket, {fields}
+            FROM {table}
+            WHERE {where} AND created_time>=%s AND created_time<%s
+            GROUP BY {group} bucket
+        """.format(table=table, where=where, group=group + ',' if group else '',
+                   fields=', '.join('{agg}({f}) AS {f}'.format(agg=agg, f=f) for f in fields))
+        cur = yield self.db.execute(sql, [start_time, bucket_width(start_time, end_time, num)] + arg + [start_time, end_time])
+        rows = cur.fetchall()
+
+        if not rows or group:
+            return rows
+        return fill_buckets(rows, start_time, end_time, num, fields)
+
+    @coroutine
+    def _get_performance(self, params):
+        """ cpu/memory/disk/net的数据都在server_metric表中, 一次查询后拆分
+        :param params: {'public_ip': str, 'start_time': timestamp, 'end_time': timestamp, 'points': int, 'sample': str}
+        :return: {'cpu': [], 'memory': [], 'disk': [], 'net': []}
         """
+        where, arg = 'public_ip=%s', [params['public_ip']]
+
+        if params.get('points'):
+            if params['sample'] == 'lttb':
+                rows = yield self._get_raw_metric('server_metric', server_metric_columns(), where, arg, params)
+                return self._server_metric_points(rows, params)
+
+            rows = yield self._get_bucket_metric('server_metric', server_metric_columns(), where, arg, params)
+            return self._server_metric_points(rows)
+
         id_sql = """
-                SELECT id FROM {table} 
+                SELECT id FROM server_metric 
                 WHERE public_ip=%s AND created_time>=%s AND created_time<%s
                 ORDER BY created_time DESC
-                """.format(table=table)
+                """
         cur = yield self.db.execute(id_sql, [params['public_ip'], params['start_time'], params['end_time']])
         ids = [i['id'] for i in cur.fetchall()]
         if not ids:
-            return []
+            return self._server_metric_points([])
         step = len(ids)//7
         choose_id = ids
 
@@ -258,70 +726,95 @@ class ServerService(BaseService):
 
         ids = get_in_formats(field='id', contents=choose_id)
         sql = """
-              SELECT created_time,content FROM {table}
-              WHERE {ids}
-              """.format(table=table, ids=ids)
-        cur = yield self.db.execute(sql, choose_id)
+              SELECT created_time, {fields} FROM server_metric
+              WHERE created_time>=%s AND created_time<%s AND {ids}
+              """.format(fields=server_metric_fields(), ids=ids)
+        cur = yield self.db.execute(sql, [params['start_time'], params['end_time']] + choose_id)
 
-        data = []
-        for x in cur.fetchall():
-            created_time = {'created_time': x['created_time']}
-            content = json.loads(x['content'])
-            content.update(created_time)
-            data.append(content)
+        return self._server_metric_points(cur.fetchall())
+
+    @coroutine
+    def _get_page(self, sql, arg, params, field):
+        ''' 性能数据的分页查询, sql需要包含id及field字段
+
+            params中有cursor(第一页传空字符串)时, 按(field, id)升序keyset分页, 每页的耗时与页数无关;
+            否则按now_page用LIMIT offset分页
+
+        :param field: 排序字段, e.g. 'created_time'
+        :return: keyset分页时为(rows, next_cursor), 没有下一页时next_cursor为None; 否则为(rows, None)
+        '''
+        page_number = int(params['page_number'])
+
+        if 'cursor' not in params:
+            sql += ' LIMIT %s, %s '
+            cur = yield self.db.execute(sql, arg + [(params['now_page'] - 1) * page_number, page_number])
+            return cur.fetchall(), None
+
+        if params['cursor']:
+            value, last_id = parse_cursor(params['cursor'])
+            sql += ' AND ({f}>%s OR ({f}=%s AND id>%s)) '.format(f=field)
+            arg = arg + [value, value, last_id]
+
+        # 多取一条用于判断是否还有下一页
+        sql += ' ORDER BY {f}, id LIMIT %s '.format(f=field)
+        cur = yield self.db.execute(sql, arg + [page_number + 1])
+        rows = cur.fetchall()
+
+        if len(rows) > page_number:
+            rows = rows[:page_number]
+            return rows, gen_cursor([rows[-1][field], rows[-1]['id']])
+
+        return rows, None
+
+    def _page_result(self, data, next_cursor, params):
+        ''' keyset分页时返回{'data': [], 'next_cursor': str}, 否则保持原来的列表
+        '''
+        if 'cursor' in params:
+            return {'data': data, 'next_cursor': next_cursor}
         return data
 
     @coroutine
     def _get_performance_page(self, params):
-        data = []
-        start_page = (params['now_page'] - 1) * params['page_number']
         arg = [
             params['public_ip'],
             params['start_time'],
             params['end_time'],
-            start_page,
-            params['page_number']
         ]
         sql = """
-            SELECT c.created_time AS created_time, c.content AS  cpu, d.content AS disk, m.content AS memory, n.content AS net
-            FROM cpu AS c
-            JOIN disk AS  d ON c.public_ip=d.public_ip AND c.created_time=d.created_time
-            JOIN memory AS m ON c.public_ip=m.public_ip AND c.created_time=m.created_time
-            JOIN net AS  n ON c.public_ip=n.public_ip AND c.created_time=n.created_time
-            WHERE c.public_ip=%s  AND c.created_time>=%s AND c.created_time<%s
-            LIMIT %s, %s
-        """
-        cur = yield self.db.execute(sql, arg)
-        for i in cur.fetchall():
+            SELECT id, created_time, {fields}
+            FROM server_metric
+            WHERE public_ip=%s  AND created_time>=%s AND created_time<%s
+        """.format(fields=server_metric_fields())
+        rows, next_cursor = yield self._get_page(sql, arg, params, 'created_time')
+
+        data = []
+        for i in rows:
             one_record = {
                 'created_time': i['created_time'],
-                'cpu': json.loads(i['cpu']),
-                'disk': json.loads(i['disk']),
-                'memory':json.loads(i['memory']),
-                'net': json.loads(i['net']),
+                'cpu': server_metric_content(i, 'cpu'),
+                'disk': server_metric_content(i, 'disk'),
+                'memory': server_metric_content(i, 'memory'),
+                'net': server_metric_content(i, 'net'),
             }
             data.append(one_record)
-        return data
+        return self._page_result(data, next_cursor, params)
 
     @coroutine
     def _get_performance_avg(self, table, params):
-        data = []
-        start_page = (params['now_page'] - 1) * params['page_number']
         arg = [
             params['public_ip'],
             params['start_time'],
             params['end_time'],
-            start_page,
-            params['page_number']
         ]
         sql = """
-                SELECT end_time,cpu_log, disk_log, memory_log, net_log
+                SELECT id, start_time, end_time, cpu_log, disk_log, memory_log, net_log
                 FROM {table}
                 WHERE public_ip=%s AND start_time>=%s AND end_time<=%s 
-                LIMIT %s, %s
             """.format(table=table)
-        cur = yield self.db.execute(sql, arg)
-        for i in cur.fetchall():
+        rows, next_cursor = yield self._get_page(sql, arg, params, 'start_time')
+
+        data = []
+        for i in rows:
             one_record = {
                 'created_time': i['end_time'],
                 'cpu': json.loads(i['cpu_log']),
@@ -330,28 +823,149 @@ class ServerService(BaseService):
                 'net': json.loads(i['net_log']),
             }
             data.append(one_record)
-        return data
+        return self._page_result(data, next_cursor, params)
 
     @coroutine
     def get_performance(self, params):
-        params['public_ip'] = yield self.fetch_public_ip(params['id'])
+        info = yield self._fetch_performance_info(params['id'])
+        params['public_ip'] = info['public_ip']
 
-        info = yield self.fetch_instance_info(params['id'])
-        if info and is_faker(info['instance_id']):
+        if info['instance_id'] and is_faker(info['instance_id']):
             return fake_performance(params)
 
         data = {}
         if params['type'] == 0:
-            data['cpu'] = yield self._get_performance('cpu', params)
-            data['memory'] = yield self._get_performance('memory', params)
-            data['disk'] = yield self._get_performance('disk', params)
-            data['net'] = yield self._get_performance('net', params)
+            self._parse_sample(params)
+
+            data = self._get_recent_performance(params)
+            if data is not None:
+                return data
+
+            data = yield self._get_performance(params)
         elif params['type'] == 1:
             data = yield self._get_performance_page(params)
         elif params['type'] == 2:
             data = yield self._get_performance_avg('server_log_hour', params)
         elif params['type'] == 3:
             data = yield self._get_performance_avg('server_log_day', params)
+        elif params['type'] == 4:
+            params['points'] = params.get('points') or DEFAULT_SAMPLE_POINTS
+            self._parse_sample(params)
+
+            data = yield self._get_auto_performance(params)
+        return data
+
+    @coroutine
+    def _get_auto_performance(self, params):
+        ''' 根据时间跨度与点数自动选择分辨率, 每个点的秒数不小于该层级每行的秒数, 查询的行数因此有上限
+
+            * 从选中的层级开始查询, 该层级没有覆盖到的头部/尾部时间段(e.g. 不对齐的开始时间, 当前小时)由更细的层级补齐
+            * 各层级在数据库中按同一组时间桶聚合, 边界上的桶由两个层级的值合并(avg按各自覆盖的秒数加权, max取最大)
+            * 汇总表中没有原始数据, sample为lttb时按avg处理
+
+        :return: {'cpu': [], 'memory': [], 'disk': [], 'net': []}, 每项正好points个点(空桶的值为None)
+        '''
+        start_time, end_time, num = params['start_time'], params['end_time'], params['points']
+        width = bucket_width(start_time, end_time, num)
+        agg = 'MAX' if params['sample'] == 'max' else 'AVG'
+
+        level = max(i for i, (_, seconds) in enumerate(METRIC_TIERS) if seconds <= width)
+
+        def merge(a, b, col):
+            weight = col + '_weight'
+            if a[col] is None or b[col] is None:
+                other = a if b[col] is None else b
+                return {col: other[col], weight: other[weight]}
+            if agg == 'MAX':
+                return {col: max(a[col], b[col]), weight: a[weight] + b[weight]}
+            total = a[weight] + b[weight]
+            return {col: (a[col] * a[weight] + b[col] * b[weight]) / total if total else (a[col] + b[col]) / 2,
+                    weight: total}
+
+        buckets = {}
+        windows = [(start_time, end_time)]
+        for table, _ in reversed(METRIC_TIERS[:level+1]):
+            if not windows:
+                break
+
+            uncovered = []
+            for begin, end in windows:
+                rows = yield self._get_tier_buckets(table, agg, begin, end, params, width)
+                if not rows:
+                    uncovered.append((begin, end))
+                    continue
+
+                for row in rows:
+                    bucket = int(row['bucket'])
+                    if bucket in buckets:
+                        merged = {}
+                        for col in server_metric_columns():
+                            merged.update(merge(row, buckets[bucket], col))
+                        row = merged
+                    buckets[bucket] = row
+
+                first = int(min(row['first_time'] for row in rows))
+                last = int(max(row['last_time'] for row in rows))
+                if first > begin:
+                    uncovered.append((begin, first))
+                if last < end:
+                    uncovered.append((last, end))
+            windows = uncovered
+
+        if not buckets:
+            return self._server_metric_points([])
+
+        rows = [dict(row, bucket=bucket) for bucket, row in buckets.items()]
+        return self._server_metric_points(fill_buckets(rows, start_time, end_time, num, server_metric_columns()))
+
+    @coroutine
+    def _get_tier_buckets(self, table, agg, begin, end, params, width):
+        ''' 按_get_auto_performance的时间桶聚合一个层级在[begin, end)内的数据
+        :return: [{'bucket': 桶序号, 'first_time': 本桶数据的开始时间, 'last_time': 本桶数据覆盖到的时间,
+                   col: 值, '{col}_weight': 值覆盖的秒数, ...}, ...]
+        '''
+        if table == 'server_metric':
+            time_field, last_field, end_op = 'created_time', 'created_time', '<'
+            values = {col: col for col in server_metric_columns()}
+            # 原始数据没有时长, 先取有值的行数, 查询后换算为本桶在[begin, end)内的秒数
+            weight = 'COUNT({v})'
+        else:
+            # 汇总表中没有数据的项为null(旧数据为空字符串), 取最大值时优先使用{key}_max(旧数据没有)
+            time_field, last_field, end_op = 'start_time', 'end_time', '<='
+            path = "COALESCE(JSON_EXTRACT({t}_log, '$.{k}_max'), JSON_EXTRACT({t}_log, '$.{k}'))" if agg == 'MAX' \
+                else "JSON_EXTRACT({t}_log, '$.{k}')"
+            values = {col: "NULLIF(NULLIF(JSON_UNQUOTE({}), ''), 'null') + 0".format(path.format(t=t, k=k))
+                      for col, t, k in SERVER_METRIC_COLUMNS}
+            weight = 'SUM(IF(({v}) IS NULL, 0, end_time-start_time))'
+
+        fields = ['{agg}({v}) AS {c}, {weight} AS {c}_weight'.format(agg=agg, v=v, c=c, weight=weight.format(v=v))
+                  for c, v in values.items()]
+        sql = """
+            SELECT FLOOR(({time}-%s)/%s) AS bucket, MIN({time}) AS first_time, MAX({last}) AS last_time, {fields}
+            FROM {table}
+            WHERE public_ip=%s AND {time}>=%s AND {last}{end_op}%s
+            GROUP BY bucket
+        """.format(time=time_field, last=last_field, end_op=end_op, table=table, fields=', '.join(fields))
+        arg = [params['start_time'], width, params['public_ip'], begin, end]
+
+        cur = yield self.db.execute(sql, arg)
+        rows = cur.fetchall()
+
+        for row in rows:
+            bucket_start = params['start_time'] + int(row['bucket']) * width
+            seconds = max(0, min(end, bucket_start + width) - max(begin, bucket_start))
+            for col in values:
+                key = col + '_weight'
+                row[key] = (seconds if row[key] else 0) if table == 'server_metric' else float(row[key])
+        return rows
+
+    @coroutine
+    def _fetch_performance_info(self, server_id):
+        ''' 一次查询主机的public_ip及对应实例的instance_id(没有实例时为None)
+        '''
+        sql = " SELECT s.public_ip, i.instance_id FROM server s LEFT JOIN instance i USING(instance_id) WHERE s.id=%s "
+        cur = yield self.db.execute(sql, server_id)
+        data = cur.fetchone()
         return data
 
     @coroutine
@@ -384,12 +998,15 @@ class ServerService(BaseService):
             yield sleep(1)
             new_ip = cloud.get_public_ip(info)
 
-        self.redis.hset(DEPLOYED, new_ip, 1)
-        self.redis.hdel(DEPLOYED, old_ip)
+        DEPLOYED_CACHE.mark(new_ip)
+        DEPLOYED_CACHE.unmark(old_ip)
         yield self.update(sets={'public_ip': new_ip}, conds={'public_ip': old_ip})
         yield self.db.execute('UPDATE instance SET public_ip = %s WHERE public_ip = %s', [new_ip, old_ip])
         yield self.db.execute('UPDATE server_account SET public_ip = %s WHERE public_ip = %s', [new_ip, old_ip])
 
+        LATEST_STORE.remove(old_ip)
+        yield self.refresh_latest(public_ip=new_ip)
+
     def _produce_cloud(self, provider):
         clouds = {
             ALIYUN_NAME: Aliyun,
@@ -507,13 +1124,20 @@ class ServerService(BaseService):
 
     @coroutine
     def _get_container_performance(self, params):
+        self._parse_sample(params)
+
+        if params.get('points'):
+            rows = yield self._get_sampled_metric('container_metric', container_metric_columns(),
+                                                  METRIC_LTTB_FIELDS['container'], 'public_ip=%s AND container_name=%s',
+                                                  [params['public_ip'], params['container_name']], params)
+            return self._container_metric_points(rows) if rows else {}
 
         sql = """
                   SELECT id from {table}
                   WHERE public_ip=%s AND container_name=%s
                   AND created_time>= %s AND created_time < %s
                   ORDER BY created_time DESC
-              """.format(table='docker_stat')
+              """.format(table='container_metric')
         cur = yield self.db.execute(sql, [params['public_ip'], params['container_name'],
                                     params['start_time'], params['end_time']])
         ids = [i['id'] for i in cur.fetchall()]
@@ -525,18 +1149,21 @@ class ServerService(BaseService):
             choose_id = [ids[i] for i in range(0, len(ids), step)]
         ids = get_in_formats(field='id', contents=choose_id)
         sql = """
-                SELECT created_time, content FROM {table}
-                WHERE {ids}
-                """.format(table='docker_stat', ids=ids)
-        cur = yield self.db.execute(sql, choose_id)
+                SELECT created_time, {fields} FROM {table}
+                WHERE created_time>=%s AND created_time<%s AND {ids}
+                """.format(table='container_metric', fields=container_metric_fields(), ids=ids)
+        cur = yield self.db.execute(sql, [params['start_time'], params['end_time']] + choose_id)
+        return self._container_metric_points(cur.fetchall())
+
+    def _container_metric_points(self, rows):
         data = {
             'cpu': [],
             'memory': [],
             'net': [],
             'block': []
         }
-        for x in cur.fetchall():
-            content = json.loads(x['content'])
+        for x in rows:
+            content = container_metric_content(x)
             cpu = {
                     'percent': content['cpu'],
                     'created_time': x['created_time'],
@@ -565,25 +1192,58 @@ class ServerService(BaseService):
 
         return data
 
+    @coroutine
+    def get_containers_performance(self, params):
+        ''' 一次查询主机所有(或指定的)容器降采样后的性能数据
+        :param params: {'id': 主机id, 'start_time': timestamp, 'end_time': timestamp,
+                        'container_names': [](可选), 'points': int(可选), 'sample': avg/max/lttb(可选)}
+        :return: {container_name: {'cpu': [], 'memory': [], 'net': [], 'block': []}, ...}
+        '''
+        params['public_ip'] = yield self.fetch_public_ip(params['id'])
+        params['points'] = params.get('points') or DEFAULT_SAMPLE_POINTS
+        self._parse_sample(params)
+
+        where, arg = 'public_ip=%s', [params['public_ip']]
+        if params.get('container_names'):
+            where += ' AND ' + get_in_formats(field='container_name', contents=params['container_names'])
+            arg.extend(params['container_names'])
+
+        fields = container_metric_columns()
+        if params['sample'] == 'lttb':
+            rows = yield self._get_raw_metric('container_metric', fields, where, arg, params, group='container_name')
+        else:
+            rows = yield self._get_bucket_metric('container_metric', fields, where, arg, params, group='container_name')
+
+        containers = {}
+        for row in rows:
+            containers.setdefault(row['container_name'], []).append(row)
+
+        data = {}
+        for name, container_rows in containers.items():
+            if params['sample'] == 'lttb':
+                container_rows = self._sample_rows(container_rows, fields, METRIC_LTTB_FIELDS['container'], params)
+            else:
+                container_rows = fill_buckets(container_rows, params['start_time'], params['end_time'],
+                                              params['points'], fields)
+            data[name] = self._container_metric_points(container_rows)
+        return data
+
     @coroutine
     def _get_container_performance_page(self, params):
-        data = []
-        start_page = (params['now_page'] - 1) * params['page_number']
         arg = [
             params['public_ip'],
             params['start_time'],
             params['end_time'],
-            start_page,
-            params['page_number']
         ]
         sql = """
-                SELECT created_time, content FROM {table}
+                SELECT id, created_time, {fields} FROM {table}
                 WHERE public_ip=%s  AND created_time>=%s AND created_time<%s
-                LIMIT %s, %s
-            """.format(table='docker_stat')
-        cur = yield self.db.execute(sql, arg)
-        for i in cur.fetchall():
-            content = json.loads(i['content'])
+            """.format(table='container_metric', fields=container_metric_fields())
+        rows, next_cursor = yield self._get_page(sql, arg, params, 'created_time')
+
+        data = []
+        for i in rows:
+            content = container_metric_content(i)
             one_record = {
                 'created_time': i['created_time'],
                 'cpu': {'percent': content['cpu']},
@@ -602,28 +1262,25 @@ class ServerService(BaseService):
                         },
             }
             data.append(one_record)
-        return data
+        return self._page_result(data, next_cursor, params)
 
     @coroutine
     def _get_container_performance_avg(self, table, params):
-        data = []
-        start_page = (params['now_page'] - 1) * params['page_number']
         arg = [
             params['public_ip'],
             params['container_name'],
             params['start_time'],
             params['end_time'],
-            start_page,
-            params['page_number']
         ]
         sql = """
-                SELECT end_time, content
+                SELECT id, start_time, end_time, content
                 FROM {table}
                 WHERE public_ip=%s AND container_name=%s AND start_time>=%s AND end_time<=%s 
-                LIMIT %s, %s
             """.format(table=table)
-        cur = yield self.db.execute(sql, arg)
-        for i in cur.fetchall():
+        rows, next_cursor = yield self._get_page(sql, arg, params, 'start_time')
+
+        data = []
+        for i in rows:
             content = json.loads(i['content'])
             one_record = {
                 'created_time': i['end_time'],
@@ -633,7 +1290,7 @@ class ServerService(BaseService):
                 'net': content['net'],
             }
             data.append(one_record)
-        return data
+        return self._page_result(data, next_cursor, params)
 
     @coroutine
     def get_container_info(self, params):
@@ -672,73 +1329,86 @@ class ServerService(BaseService):
         update instance set status=%s where public_ip=%s
         """
         yield self.db.execute(sql, [status, ip])
+        yield self.refresh_latest(public_ip=ip)
 
-    @coroutine
-    def _get_monitor_data(self, ip, table):
-        sql = "SELECT content FROM {TABLE} WHERE public_ip=%s ORDER BY created_time DESC LIMIT 1".format(TABLE=table)
-        cur = yield self.db.execute(sql, [ip])
-        data = cur.fetchone()
-        if data:
-            return data['content']
-        return
+    def _get_monitor_data(self, ips):
+        ''' 一次hmget取出主机最新的上报数据(SERVERS_REPORT_INFO)
+        :return: {ip: 与server_metric表的一行相同结构的dict}
+        '''
+        if not ips:
+            return {}
 
-    @coroutine
-    def _get_ip_name(self, sid):
-        sql = "SELECT public_ip, name FROM server WHERE id=%s limit 1"
-        cur = yield self.db.execute(sql, [sid])
-        data = cur.fetchone()
+        data = {}
+        for ip, info in zip(ips, self.redis.hmget(SERVERS_REPORT_INFO, ips)):
+            metric = self._monitor_metric(json_loads(info))
+            if metric:
+                data[ip] = metric
         return data
 
+    def _monitor_metric(self, report):
+        ''' 最新上报数据 -> 与server_metric表的一行相同结构的dict, 超过REPORT_FRESHNESS秒没有上报的主机视为没有数据(None)
+        '''
+        if not report or int(report.get('time') or 0) < int(time.time()) - REPORT_FRESHNESS:
+            return None
+
+        return server_metric_row(server_metric_values(report))
+
     @coroutine
-    def _get_max_bandwidth(self, ip):
-        sql = "SELECT internet_max_bandwidth_in, internet_max_bandwidth_out FROM instance WHERE public_ip=%s limit 1"
-        cur = yield self.db.execute(sql, [ip])
-        data = cur.fetchone()
-        return data
+    def _get_monitor_info(self, sids):
+        ''' 一次查询主机的名称及对应实例的最大带宽(没有实例时为None)
+        :return: {sid: {'public_ip', 'name', 'internet_max_bandwidth_in', 'internet_max_bandwidth_out'}}
+        '''
+        if not sids:
+            return {}
+
+        sql = """
+            SELECT s.id, s.public_ip, s.name, i.internet_max_bandwidth_in, i.internet_max_bandwidth_out
+            FROM server s LEFT JOIN instance i ON i.public_ip=s.public_ip
+            WHERE {ids}
+        """.format(ids=get_in_formats(field='s.id', contents=sids))
+        cur = yield self.db.execute(sql, sids)
+        return {i['id']: i for i in cur.fetchall()}
 
     @coroutine
-    def get_monitor_data(self, sids):
+    def get_monitor_data(self, sids, lord=None, form=None):
+        ''' 主机的监控数据, 指定租户时从LATEST_STORE一次读取, 其中没有的主机(及未指定租户时)一次查询数据库和redis
+        '''
+        sids = [int(i) for i in sids]
+        servers = (LATEST_STORE.load(lord, form) if lord else None) or []
+
+        info = {i['id']: i for i in servers if i['id'] in sids}
+        metrics = {i['public_ip']: self._monitor_metric(i['report']) for i in info.values()}
+
+        missing = [i for i in sids if i not in info]
+        if missing:
+            data = yield self._get_monitor_info(missing)
+            info.update(data)
+            metrics.update(self._get_monitor_data([i['public_ip'] for i in data.values()]))
+
         server_monitor_data = []
         for i in sids:
-            server_info = yield self._get_ip_name(i)
+            server_info = info.get(i)
             if not server_info:
                 continue
 
             ip, name = server_info['public_ip'], server_info['name']
 
-            cpu_content = yield self._get_monitor_data(ip=ip, table='cpu')
-            if cpu_content is None:
-                self.log.error("server {ip} does not exist".format(ip=ip))
-                continue
-            cpu_percent = float(json.loads(cpu_content)['percent'])
-
-            mem_content = yield self._get_monitor_data(ip=ip, table='memory')
-            if mem_content is None:
+            metric = metrics.get(ip)
+            if metric is None:
                 self.log.error("server {ip} does not exist".format(ip=ip))
                 continue
-            mem_usage_rate = float(json.loads(mem_content)['percent'])
-
-            disk_content = yield self._get_monitor_data(ip=ip, table='disk')
-            if disk_content is None:
-                self.log.error("server {ip} does not exist".format(ip=ip))
-                continue
-            disk_content = json.loads(disk_content)
-            disk_usage_rate = float(disk_content['percent'])
-            disk_utilize = disk_content['utilize']
-
-            net_content = yield self._get_monitor_data(ip=ip, table='net')
-            if net_content is None:
-                self.log.error("server {ip} does not exist".format(ip=ip))
-                continue
-            net_download = (json.loads(net_content))['input']
-            net_upload = (json.loads(net_content))['output']
-
-            bandwidth = yield self._get_max_bandwidth(ip)
-            if bandwidth is None:
+            cpu_percent = metric['cpu_percent']
+            mem_usage_rate = metric['mem_percent']
+            disk_usage_rate = metric['disk_percent']
+            disk_utilize = metric['disk_utilize']
+            net_download = metric['net_input']
+            net_upload = metric['net_output']
+
+            if server_info['internet_max_bandwidth_in'] is None:
                 self.log.error("server {ip} max bandwidth does not exist".format(ip=ip))
                 continue
-            max_input = bandwidth['internet_max_bandwidth_in']
-            max_output = bandwidth['internet_max_bandwidth_out']
+            max_input = server_info['internet_max_bandwidth_in']
+            max_output = server_info['internet_max_bandwidth_out']
 
             net_input = (net_download/(int(max_input)*1000))*100
             net_output = (net_upload/(int(max_output)*1000))*100
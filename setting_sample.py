@@ -35,6 +35,18 @@ settings['redis_host'] = 'localhost'
 settings['redis_port'] = 6379
 
 
+#################################################################################################
+# 主机上报配置
+#################################################################################################
+settings['report_queue'] = False  # True: 上报只入队(返回202), 由crontab/report_worker.py异步保存
+settings['metric_partition_interval'] = 86400  # server_metric/container_metric表每个分区的时间跨度(秒)
+settings['metric_partition_ahead'] = 3  # 提前创建的分区数
+settings['metric_retention'] = 30 * 86400  # 性能数据保留时间(秒), 过期的分区整体删除, 见crontab/metric_partition.py
+settings['metric_minute_retention'] = 7 * 86400  # server_log_minute的保留时间(秒), 由crontab/metric_partition.py删除
+settings['rollup_processes'] = 0  # crontab/sync_server_log.py计算统计值的进程数, 0: 与CPU核数相同, 1: 不使用进程池
+settings['rollup_minute_lag'] = 120  # 分钟汇总等待上报写入的秒数, 开启上报队列时不小于队列延迟
+
+
 #################################################################################################
 # 阿里云配置
 #################################################################################################
@@ -0,0 +1,83 @@
+__author__ = 'Jon'
+
+'''
+已部署主机ip的进程内缓存
+
+    usage::
+    >>> from utils.deployed import DEPLOYED_CACHE
+    >>> DEPLOYED_CACHE.start()                # 进程启动时调用, 全量加载并订阅变化
+    >>> DEPLOYED_CACHE.is_deployed('1.1.1.1')
+    >>> DEPLOYED_CACHE.mark('1.1.1.1')        # 代替 hset(DEPLOYED, ...)
+    >>> DEPLOYED_CACHE.unmark('1.1.1.1')      # 代替 hdel(DEPLOYED, ...)
+
+说明
+---------------
+* 以redis的DEPLOYED为准, 修改部署状态的地方都通过mark/unmark, 同时publish到DEPLOYED_CHANNEL
+* 后台线程订阅DEPLOYED_CHANNEL, 每次(重新)订阅成功后全量重新加载, 避免漏掉断线期间的变化
+* 没有调用start()的进程(e.g. crontab脚本)直接查询redis
+'''
+import time
+import threading
+import traceback
+
+from utils.db import REDIS
+from utils.log import LOG
+from constant import DEPLOYED, DEPLOYED_FLAG, DEPLOYED_CHANNEL, DEPLOYED_RETRY
+
+
+class DeployedCache():
+    def __init__(self, redis):
+        self.redis = redis
+        self.ips = set()
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+
+        self.load()
+        self.running = True
+
+        thread = threading.Thread(target=self._listen, name='deployed-cache', daemon=True)
+        thread.start()
+
+    def load(self):
+        self.ips = set(self.redis.hkeys(DEPLOYED))
+
+    def is_deployed(self, ip):
+        if self.running:
+            return ip in self.ips
+
+        return bool(self.redis.hget(DEPLOYED, ip))
+
+    def mark(self, ip):
+        self.redis.hset(DEPLOYED, ip, DEPLOYED_FLAG)
+        self.ips.add(ip)
+        self.redis.publish(DEPLOYED_CHANNEL, 'add:{}'.format(ip))
+
+    def unmark(self, ip):
+        self.redis.hdel(DEPLOYED, ip)
+        self.ips.discard(ip)
+        self.redis.publish(DEPLOYED_CHANNEL, 'del:{}'.format(ip))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(DEPLOYED_CHANNEL)
+
+                for msg in pubsub.listen():
+                    if msg['type'] == 'subscribe':
+                        self.load()
+                    elif msg['type'] == 'message':
+                        action, ip = msg['data'].split(':', 1)
+                        if action == 'add':
+                            self.ips.add(ip)
+                        else:
+                            self.ips.discard(ip)
+            except Exception:
+                LOG.error(traceback.format_exc())
+                time.sleep(DEPLOYED_RETRY)
+
+
+DEPLOYED_CACHE = DeployedCache(REDIS)
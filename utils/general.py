@@ -6,6 +6,7 @@ __author__ = 'Jon'
 import re
 import random
 import json
+import base64
 from hashlib import md5
 from constant import USER_AGENTS
 
@@ -108,6 +109,20 @@ def json_dumps(data):
     ''' json can dumps None '''
     return json.dumps(data) if data else '{}'
 
+def gen_cursor(values):
+    ''' 生成keyset分页的cursor
+    :param values: 上一页最后一行的排序字段值, e.g. [1520000000, 123], datetime等转为字符串
+    :return: str
+    '''
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def parse_cursor(cursor):
+    ''' gen_cursor的逆过程 '''
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError('cursor错误')
+
 def gen_md5(fp):
     m = md5()
     m.update(fp)
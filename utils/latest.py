@@ -0,0 +1,124 @@
+__author__ = 'Jon'
+
+'''
+主机最新状态的物化存储, 主机列表/集群详情/监控墙/告警列表直接读取, 不再每次联表查询并合并上报信息
+
+    usage::
+    >>> from utils.latest import LATEST_STORE
+    >>> LATEST_STORE.save(rows)                       # rows为LATEST_SQL的查询结果
+    >>> LATEST_STORE.save_report(pipe, ip, report)    # 上报时写入最新上报数据
+    >>> LATEST_STORE.load(lord, form)                 # 租户的全部主机
+
+说明
+---------------
+* 每个租户(lord/form)一个hash(SERVER_LATEST), field '{sid}'为主机与实例信息, '{sid}:report'为最新上报数据
+* SERVER_LATEST_INDEX记录public_ip对应的hash及主机id, 上报时由lua脚本一次查找并写入, 不在索引中的主机不写入
+* 主机与实例信息由ServerService.refresh_latest(主机增删改)及crontab/instance.py(每次同步实例后全量重建)维护
+* 全量重建时在租户的hash中写入BUILT_FIELD, 没有该标记的租户(e.g. 刚部署/redis清空后只刷新了个别主机)数据不完整, load返回None
+'''
+from utils.db import REDIS
+from utils.general import json_loads, json_dumps
+from constant import SERVER_LATEST, SERVER_LATEST_INDEX
+
+# 主机与实例信息, {where}为空时查询全部主机
+LATEST_SQL = """
+    SELECT s.id, s.name, s.public_ip, s.cluster_id, s.lord, s.form, i.instance_id, i.provider, i.instance_name,
+           i.region_name AS address, i.status AS machine_status,
+           i.internet_max_bandwidth_in, i.internet_max_bandwidth_out
+    FROM server s
+    JOIN instance i USING(instance_id)
+    {where}
+"""
+
+BUILT_FIELD = '_built'  # 租户已全量重建的标记
+
+# KEYS: SERVER_LATEST_INDEX; ARGV: public_ip, 上报数据
+SAVE_REPORT_SCRIPT = """
+local loc = redis.call('HGET', KEYS[1], ARGV[1])
+if loc then
+    local i = string.find(loc, ':', 1, true)
+    redis.call('HSET', string.sub(loc, 1, i - 1), string.sub(loc, i + 1) .. ':report', ARGV[2])
+end
+"""
+
+
+class LatestStore():
+    def __init__(self, redis):
+        self.redis = redis
+        self.report_script = redis.register_script(SAVE_REPORT_SCRIPT)
+
+    def key(self, lord, form):
+        return SERVER_LATEST.format(lord=lord, form=form)
+
+    def save(self, rows, rebuild=False):
+        ''' 写入主机与实例信息
+        :param rows:    LATEST_SQL的查询结果
+        :param rebuild: rows是否为全部主机, 是时删除不在rows中的主机
+        '''
+        index = {}
+        pipe = self.redis.pipeline()
+
+        for row in rows:
+            key = self.key(row['lord'], row['form'])
+            pipe.hset(key, row['id'], json_dumps(row))
+            index[row['public_ip']] = '{}:{}'.format(key, row['id'])
+
+        if rebuild:
+            # 主机换ip后旧ip的索引与新ip指向同一个主机, 只删除旧ip的索引, 保留主机数据
+            claimed = set(index.values())
+            for ip, loc in self.redis.hgetall(SERVER_LATEST_INDEX).items():
+                if index.get(ip) == loc:
+                    continue
+
+                if loc in claimed:
+                    pipe.hdel(SERVER_LATEST_INDEX, ip)
+                else:
+                    self._remove(pipe, ip, loc, unindex=ip not in index)
+
+            for key in {loc.split(':', 1)[0] for loc in claimed}:
+                pipe.hset(key, BUILT_FIELD, 1)
+
+        if index:
+            pipe.hmset(SERVER_LATEST_INDEX, index)
+        pipe.execute()
+
+    def remove(self, public_ip):
+        loc = self.redis.hget(SERVER_LATEST_INDEX, public_ip)
+        if loc:
+            pipe = self.redis.pipeline()
+            self._remove(pipe, public_ip, loc)
+            pipe.execute()
+
+    def _remove(self, pipe, public_ip, loc, unindex=True):
+        key, sid = loc.split(':', 1)
+        pipe.hdel(key, sid, sid + ':report')
+        if unindex:
+            pipe.hdel(SERVER_LATEST_INDEX, public_ip)
+
+    def save_report(self, pipe, public_ip, report):
+        ''' 在pipe中写入最新上报数据
+        :param report: json字符串
+        '''
+        self.report_script(keys=[SERVER_LATEST_INDEX], args=[public_ip, report], client=pipe)
+
+    def load(self, lord, form):
+        ''' 租户的全部主机
+        :return: [{主机与实例信息, 'report': 最新上报数据(没有上报过时为{})}, ...], 租户还没有全量重建过时为None
+        '''
+        data = self.redis.hgetall(self.key(lord, form))
+        if BUILT_FIELD not in data:
+            return None
+
+        servers = []
+        for field, value in data.items():
+            if ':' in field or field == BUILT_FIELD:
+                continue
+
+            server = json_loads(value)
+            server['report'] = json_loads(data.get(field + ':report'))
+            servers.append(server)
+
+        return servers
+
+
+LATEST_STORE = LatestStore(REDIS)
@@ -0,0 +1,150 @@
+__author__ = 'Jon'
+
+'''
+性能数据与server_metric/container_metric表字段之间的转换
+
+    usage::
+    >>> server_metric_values({'cpu': {'percent': 1.5}, 'memory': {...}, 'disk': {...}, 'net': {...}})
+    [1.5, ...]
+    >>> server_metric_content({'cpu_percent': 1.5, ...}, 'cpu')
+    {'percent': 1.5}
+'''
+import time
+from constant import SERVER_METRIC_COLUMNS, CONTAINER_METRIC_COLUMNS, METRIC_ROLLUP
+
+# 累计一次上报的数据
+# KEYS: 各时间粒度的METRIC_ROLLUP; ARGV: 过期秒数(与KEYS一一对应)..., public_ip, 字段1, 值1, 字段2, 值2...
+ROLLUP_SCRIPT = """
+local n = #KEYS
+local ip = ARGV[n + 1]
+for i, key in ipairs(KEYS) do
+    redis.call('HINCRBY', key, ip .. ':count', 1)
+    for j = n + 2, #ARGV, 2 do
+        local f = ip .. ':' .. ARGV[j] .. ':'
+        local v = tonumber(ARGV[j + 1])
+        redis.call('HINCRBYFLOAT', key, f .. 'sum', v)
+        redis.call('HINCRBYFLOAT', key, f .. 'sumsq', v * v)
+        local min = redis.call('HGET', key, f .. 'min')
+        if not min or v < tonumber(min) then
+            redis.call('HSET', key, f .. 'min', ARGV[j + 1])
+        end
+        local max = redis.call('HGET', key, f .. 'max')
+        if not max or v > tonumber(max) then
+            redis.call('HSET', key, f .. 'max', ARGV[j + 1])
+        end
+    end
+    redis.call('EXPIRE', key, ARGV[i])
+end
+"""
+
+
+def to_float(value):
+    ''' 上报的数值可能是数字或字符串, 无法转换时为0
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def server_metric_columns(table=None):
+    '''
+    :param table: cpu/memory/disk/net, 为None时返回全部字段
+    :return: e.g. ['cpu_percent', 'mem_total', ...]
+    '''
+    return [col for col, t, _ in SERVER_METRIC_COLUMNS if table is None or t == table]
+
+
+def container_metric_columns():
+    return [col for col, _ in CONTAINER_METRIC_COLUMNS]
+
+
+def server_metric_fields(table=None, prefix=''):
+    '''
+    :param table:  cpu/memory/disk/net, 为None时返回全部字段
+    :param prefix: 表别名, e.g. 'm.'
+    :return: e.g. 'cpu_percent, mem_total, ...'
+    '''
+    return ', '.join(prefix + col for col in server_metric_columns(table))
+
+
+def container_metric_fields(prefix=''):
+    return ', '.join(prefix + col for col in container_metric_columns())
+
+
+def server_metric_values(report):
+    ''' 主机上报数据 -> server_metric表字段的值, 顺序同server_metric_fields()
+    '''
+    return [to_float((report.get(table) or {}).get(key)) for _, table, key in SERVER_METRIC_COLUMNS]
+
+
+def container_metric_values(stat):
+    ''' 上报的单个容器数据 -> container_metric表字段的值, 顺序同container_metric_fields()
+    '''
+    return [to_float(stat.get(key)) for _, key in CONTAINER_METRIC_COLUMNS]
+
+
+def server_metric_row(values):
+    ''' server_metric_values()的结果 -> 与server_metric表的一行相同结构的dict
+    '''
+    return dict(zip(server_metric_columns(), values))
+
+
+def server_metric_content(row, table):
+    ''' server_metric表的一行 -> 与上报时相同结构的cpu/memory/disk/net数据
+    '''
+    return {key: row[col] for col, t, key in SERVER_METRIC_COLUMNS if t == table}
+
+
+def container_metric_content(row):
+    ''' container_metric表的一行 -> 与上报时相同结构的容器数据
+    '''
+    return {key: row[col] for col, key in CONTAINER_METRIC_COLUMNS}
+
+
+def rollup_bucket(t, seconds):
+    ''' t所在时间段(按本地时间对齐)的起始时间 '''
+    t = int(t)
+    return t - (t - time.timezone) % seconds
+
+
+def rollup_key(resolution, bucket):
+    return METRIC_ROLLUP.format(resolution=resolution, bucket=bucket)
+
+
+def rollup_fields(ip):
+    ''' 一台主机在METRIC_ROLLUP中的全部field, 用于只hmget这台主机的数据 '''
+    return [ip + ':count'] + ['{}:{}:{}'.format(ip, col, stat) for col in server_metric_columns()
+                              for stat in ['sum', 'sumsq', 'min', 'max']]
+
+
+def parse_rollup(data):
+    ''' METRIC_ROLLUP的内容 -> 各主机各字段的统计值
+
+    :param data: hgetall的结果, 或rollup_fields的hmget结果组成的dict(没有的field为None)
+    :return: {ip: {'count': int, col: {'avg', 'min', 'max', 'std'}, ...}}
+    '''
+    raw = {}
+    for field, value in data.items():
+        if value is None:
+            continue
+        ip, rest = field.split(':', 1)
+        raw.setdefault(ip, {})[rest] = float(value)
+
+    result = {}
+    for ip, values in raw.items():
+        count = int(values.get('count', 0))
+        if not count:
+            continue
+
+        result[ip] = {'count': count}
+        for col in server_metric_columns():
+            total, sumsq = values.get(col + ':sum', 0), values.get(col + ':sumsq', 0)
+            avg = total / count
+            result[ip][col] = {
+                'avg': avg,
+                'min': values.get(col + ':min'),
+                'max': values.get(col + ':max'),
+                'std': max(sumsq / count - avg * avg, 0) ** 0.5
+            }
+    return result
@@ -0,0 +1,54 @@
+__author__ = 'Jon'
+
+'''
+主机名搜索的进程内索引
+
+    usage::
+    >>> index = NameIndex([{'id': 1, 'name': 'web-01'}, {'id': 2, 'name': 'db-01'}], version='3')
+    >>> sorted(index.search('-01'))
+    [1, 2]
+
+说明
+---------------
+* 每个租户(lord/form)一个索引, 按主机名的trigram(连续3个字符)建立倒排表, 搜索结果与原来的子串匹配相同
+* 主机增加/改名/删除时递增redis中租户的SERVER_NAME_VERSION(bump_version), 各进程搜索前比较版本号, 不一致时重建索引
+'''
+from constant import SERVER_NAME_VERSION
+
+
+def bump_version(redis, servers):
+    ''' 主机名变化后递增所在租户的版本号
+    :param servers: [{'lord': int, 'form': int}, ...]
+    '''
+    pipe = redis.pipeline()
+    for lord, form in {(i['lord'], i['form']) for i in servers}:
+        pipe.incr(SERVER_NAME_VERSION.format(lord=lord, form=form))
+    pipe.execute()
+
+
+class NameIndex():
+    def __init__(self, servers, version):
+        ''' :param servers: [{'id': int, 'name': str}, ...] '''
+        self.version = version
+        self.names = {}
+        self.grams = {}
+
+        for server in servers:
+            self.names[server['id']] = server['name']
+            for gram in self._grams(server['name']):
+                self.grams.setdefault(gram, set()).add(server['id'])
+
+    def _grams(self, s):
+        return {s[i:i+3] for i in range(len(s) - 2)}
+
+    def search(self, keyword):
+        ''' 名称包含keyword的主机
+        :return: [id, ...]
+        '''
+        grams = self._grams(keyword)
+        if grams:
+            ids = set.intersection(*[self.grams.get(gram, set()) for gram in grams])
+        else:
+            ids = self.names.keys()
+
+        return [i for i in ids if keyword in self.names[i]]
@@ -0,0 +1,161 @@
+__author__ = 'Jon'
+
+'''
+主机上报数据的解析工具
+'''
+import re
+import zlib
+import codecs
+import json
+import yaml
+from collections import OrderedDict
+
+from utils.general import gen_md5
+from utils.error import AppError
+from constant import K8S_PARSE_CACHE_SIZE, K8S_DUMP_CACHE_SIZE, REPORT_BULK_MAX_SIZE
+
+# 优先使用libyaml(C实现)
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+READ_CHUNK_SIZE = 1024 * 1024  # 每次解压/解码的字节数
+SEPARATORS = re.compile(r'[\s,\[\]]*')  # 上报数据之间的分隔符
+
+
+class LRUCache():
+    ''' 进程内的LRU缓存, 超过size时淘汰最久未使用的
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def get(self, key):
+        if key not in self.data:
+            return None
+
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+
+_k8s_items_cache = LRUCache(K8S_PARSE_CACHE_SIZE)
+_k8s_dump_cache = LRUCache(K8S_DUMP_CACHE_SIZE)
+
+
+def _iter_chunks(body, gzipped=False, max_size=REPORT_BULK_MAX_SIZE):
+    ''' 按块返回body, gzip压缩的body边解压边返回, 每块解压后不超过READ_CHUNK_SIZE字节
+    :param max_size: 解压后的最大字节数, 超过时抛出AppError(413)
+    '''
+    if not gzipped:
+        for i in range(0, len(body), READ_CHUNK_SIZE):
+            yield body[i:i+READ_CHUNK_SIZE]
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    size, fed = 0, False
+
+    for i in range(0, len(body), READ_CHUNK_SIZE):
+        data = body[i:i+READ_CHUNK_SIZE]
+        while data:
+            try:
+                chunk = decompressor.decompress(data, READ_CHUNK_SIZE)
+            except zlib.error as e:
+                raise AppError('gzip数据错误: {}'.format(e))
+
+            size += len(chunk)
+            if size > max_size:
+                raise AppError('解压后的数据超过{}字节'.format(max_size), code=413)
+
+            if decompressor.eof:
+                # 多个gzip member拼接而成的body, 剩余数据由新的decompressor解压下一个member
+                data, fed = decompressor.unused_data, False
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data, fed = decompressor.unconsumed_tail, True
+            yield chunk
+
+    if fed:
+        raise AppError('gzip数据不完整')
+
+
+def _is_incomplete(e, buf):
+    ''' raw_decode的错误是否只是因为数据还不完整(在buf末尾), 不是格式错误 '''
+    return e.msg.startswith('Unterminated string') or e.pos >= len(buf) - 6
+
+
+def iter_reports(body, gzipped=False):
+    ''' 逐个解析批量上报的数据, 不需要一次性解压/解析整个body
+
+    :param body:    bytes, JSON数组([{...}, {...}]) 或 每行一个JSON(NDJSON)
+    :param gzipped: body是否gzip压缩
+
+    Usage::
+        >>> for report in iter_reports(b'{"public_ip": "1.1.1.1"}\\n{"public_ip": "2.2.2.2"}'):
+        ...     print(report['public_ip'])
+
+    :return: generator, 每次返回一个上报数据(dict)
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf, pos = '', 0
+
+    for chunk in _iter_chunks(body, gzipped):
+        # 只保留还没有解析的部分, 已解析的数据不重复拷贝
+        buf, pos = buf[pos:] + text_decoder.decode(chunk), 0
+
+        while True:
+            pos = SEPARATORS.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+
+            try:
+                report, pos = decoder.raw_decode(buf, pos)
+            except ValueError as e:
+                if _is_incomplete(e, buf):
+                    break  # 数据不完整, 等待下一块
+                raise AppError('批量上报数据格式错误: {}'.format(e))
+
+            yield report
+
+    buf = (buf[pos:] + text_decoder.decode(b'', final=True))
+    buf = buf[SEPARATORS.match(buf).end():]
+    if buf:
+        raise AppError('批量上报数据格式错误: {}'.format(buf[:100]))
+
+
+def load_k8s_items(blob):
+    ''' 解析上报的k8s资源列表(kubectl get xxx -o json/yaml), 内容相同的blob只解析一次
+
+    :param blob: str, JSON或YAML
+    :return: [(item, digest), ...], item为k8s对象(与缓存共享, 不能修改), digest为item内容的md5
+    '''
+    key = gen_md5(blob.encode())
+    items = _k8s_items_cache.get(key)
+
+    if items is None:
+        doc = json.loads(blob) if blob.lstrip().startswith('{') else yaml.load(blob, Loader=YamlLoader)
+        items = [(item, gen_md5(json.dumps(item, sort_keys=True, default=str).encode()))
+                 for item in (doc or {}).get('items') or []]
+        _k8s_items_cache.set(key, items)
+
+    return items
+
+
+def dump_k8s_item(item, digest):
+    ''' k8s对象转为YAML(存入verbose字段), 相同digest的对象只转换一次
+    '''
+    verbose = _k8s_dump_cache.get(digest)
+
+    if verbose is None:
+        verbose = yaml.dump(item, Dumper=YamlDumper, default_flow_style=False)
+        _k8s_dump_cache.set(digest, verbose)
+
+    return verbose
@@ -0,0 +1,95 @@
+__author__ = 'Jon'
+
+'''
+性能数据的降采样
+
+    usage::
+    >>> rows = [{'created_time': 1520000000, 'cpu_percent': 1.5}, ...]
+    >>> bucket_points(rows, 1520000000, 1520003600, 60, ['cpu_percent'], agg='max')   # 60个点, 每个点为桶内最大值
+    >>> lttb(rows, 60, key=lambda x: x['cpu_percent'])                                 # 保留峰值的60个原始点
+'''
+
+
+def bucket_width(start_time, end_time, num):
+    ''' [start_time, end_time)分成num个桶时每个桶的秒数(向上取整) '''
+    return max(1, -(-(end_time - start_time) // num))
+
+
+def fill_buckets(rows, start_time, end_time, num, fields):
+    ''' 按桶聚合后的数据补齐为正好num个点, 没有数据的桶各字段为None
+
+    :param rows:   [{'bucket': 桶序号, field: 值, ...}, ...]
+    :param fields: 数据字段, e.g. ['cpu_percent']
+    :return: [{'created_time': 桶的起始时间, field: 值, ...}, ...]
+    '''
+    width = bucket_width(start_time, end_time, num)
+    buckets = {int(row['bucket']): row for row in rows}
+
+    data = []
+    for i in range(num):
+        row = buckets.get(i, {})
+        point = {field: row.get(field) for field in fields}
+        point['created_time'] = start_time + i * width
+        data.append(point)
+    return data
+
+
+def bucket_points(rows, start_time, end_time, num, fields, agg='avg'):
+    ''' 在内存中按桶聚合, 结果同数据库中GROUP BY后fill_buckets
+    :param agg: avg/max
+    '''
+    width = bucket_width(start_time, end_time, num)
+    buckets = {}
+
+    for row in rows:
+        buckets.setdefault((row['created_time'] - start_time) // width, []).append(row)
+
+    data = []
+    for bucket, items in buckets.items():
+        point = {'bucket': bucket}
+        for field in fields:
+            values = [item[field] for item in items]
+            point[field] = max(values) if agg == 'max' else sum(values) / len(values)
+        data.append(point)
+
+    return fill_buckets(data, start_time, end_time, num, fields)
+
+
+def lttb(rows, num, key):
+    ''' Largest-Triangle-Three-Buckets: 从按时间排序的原始点中选出num个, 保留曲线的峰谷
+
+    :param rows: [{'created_time': int, ...}, ...], 按created_time升序
+    :param key:  取点的依据, e.g. lambda x: x['cpu_percent']
+    :return: rows的子集
+    '''
+    if num >= len(rows):
+        return rows
+    if num < 3:
+        # 不足3个点时没有中间的桶, 只保留首尾
+        return [rows[0], rows[-1]][:num]
+
+    every = (len(rows) - 2) / (num - 2)
+    sampled = [rows[0]]
+    a = 0
+
+    for i in range(num - 2):
+        # 下一个桶的平均点
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(rows))
+        avg_x = sum(rows[j]['created_time'] for j in range(avg_start, avg_end)) / (avg_end - avg_start)
+        avg_y = sum(key(rows[j]) for j in range(avg_start, avg_end)) / (avg_end - avg_start)
+
+        # 当前桶中与上一个选中点、下一个桶平均点组成的三角形面积最大的点
+        ax, ay = rows[a]['created_time'], key(rows[a])
+        max_area, chosen = -1, None
+
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (key(rows[j]) - ay) - (ax - rows[j]['created_time']) * (avg_y - ay))
+            if area > max_area:
+                max_area, chosen = area, j
+
+        sampled.append(rows[chosen])
+        a = chosen
+
+    sampled.append(rows[-1])
+    return sampled